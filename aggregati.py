@@ -0,0 +1,152 @@
+"""Cubo aggregato Anno × Mese × Servizio e tabelle di confronto calcolate a partire da esso.
+
+Il cubo viene costruito una sola volta al caricamento: tabelle e grafici interrogano il cubo
+(poche righe per anno) invece di rifare pivot e groupby sul dataset completo a ogni rerun.
+"""
+import pandas as pd
+
+from ingestione import SERVIZI_ORDER
+
+MISURE = ['Importo Totale', 'Numero Titoli']
+DIMENSIONI = ['Anno', 'Mese', 'Servizio']
+SOSTA_OCCASIONALE = ['Parcometri', 'Hub Sosta (App)', 'Tap&Park (ricariche)']
+# Viste del menu servizi: tutti, aggregato della sosta occasionale o singolo servizio.
+VISTE = ['Tutti i Servizi', 'Sosta Occasionale (Aggregato)'] + SERVIZI_ORDER
+# Unica mappa dei mesi per tabelle, grafici ed export: fissa in italiano, non dipende dal locale del server.
+NOMI_MESI = dict(enumerate(['Gennaio', 'Febbraio', 'Marzo', 'Aprile', 'Maggio', 'Giugno', 'Luglio', 'Agosto',
+                            'Settembre', 'Ottobre', 'Novembre', 'Dicembre'], start=1))
+
+
+# --- COSTRUZIONE DEL CUBO ---
+def costruisci_cubo(df):
+    """Aggrega il dataset in formato lungo: una riga per ogni (Anno, Mese, Servizio) osservato."""
+    cubo = df.groupby(DIMENSIONI, observed=True)[MISURE].sum().reset_index()
+    cubo['Servizio'] = pd.Categorical(cubo['Servizio'], categories=SERVIZI_ORDER, ordered=True)
+    return cubo
+
+
+def somma_cubi(*cubi):
+    """Somma cella per cella più cubi (es. dati + rettifiche)."""
+    return costruisci_cubo(pd.concat(cubi, ignore_index=True))
+
+
+def periodi_per_anno(df):
+    """Prima e ultima data disponibili per ogni anno, usate nell'intestazione del dettaglio annuale."""
+    return df.groupby('Anno')['DATA_ORA_INSERIMENTO'].agg(['min', 'max'])
+
+
+# --- INTERROGAZIONI ---
+def filtra_servizi(cubo, vista):
+    """Restringe il cubo a una delle viste del menu ('Tutti i Servizi', aggregato sosta occasionale o singolo servizio)."""
+    if vista == 'Tutti i Servizi': return cubo
+    if vista == 'Sosta Occasionale (Aggregato)': return cubo[cubo['Servizio'].isin(SOSTA_OCCASIONALE)]
+    return cubo[cubo['Servizio'] == vista]
+
+
+def pivot_cubo(cubo, misura, righe, colonne):
+    """Equivalente di `pivot_table(aggfunc='sum').fillna(0)` calcolato sulle celle del cubo."""
+    return cubo.groupby([righe, colonne], observed=True)[misura].sum().unstack(colonne, fill_value=0).astype('float64')
+
+
+def pivot_per_servizio(cubo, misura):
+    """Servizi (tutti, nell'ordine standard) × Anni."""
+    return pivot_cubo(cubo, misura, 'Servizio', 'Anno').reindex(SERVIZI_ORDER, fill_value=0)
+
+
+def colonne_variazioni(anni):
+    """Coppie di anni consecutivi confrontati e nomi delle colonne di variazione: [(anno, anno_successivo, assoluta, %)].
+
+    Con due anni si usano i nomi storici 'Variazione Assoluta' e 'Variazione %'.
+    """
+    coppie = list(zip(anni, anni[1:]))
+    if len(coppie) == 1: return [(*coppie[0], 'Variazione Assoluta', 'Variazione %')]
+    return [(a, b, f"Var. {b} vs {a}", f"Var. % {b} vs {a}") for a, b in coppie]
+
+
+def aggiungi_variazioni(pivot, anni):
+    """Aggiunge variazione assoluta e percentuale tra anni consecutivi e la riga TOTALE."""
+    pivot = pivot.reindex(columns=list(anni), fill_value=0)
+    variazioni = colonne_variazioni(anni)
+    for a, b, col_abs, col_pct in variazioni:
+        pivot[col_abs] = pivot[b] - pivot[a]
+        pivot[col_pct] = (pivot[col_abs] / pivot[a].replace(0, pd.NA)) * 100
+    totali = pivot.sum()
+    for a, _, col_abs, col_pct in variazioni:
+        totali[col_pct] = (totali[col_abs] / totali[a]) * 100 if totali[a] != 0 else 0
+    totali.name = 'TOTALE'
+    pivot_con_totale = pd.concat([pivot, totali.to_frame().T])
+    pivot_con_totale.columns = [str(c) for c in pivot_con_totale.columns]
+    return pivot_con_totale
+
+
+def tabella_confronto_servizi(cubo, misura, anni):
+    return aggiungi_variazioni(pivot_per_servizio(cubo, misura), anni)
+
+
+def tabella_redditivita(cubo, anni):
+    """Redditività media (€/titolo) per servizio; il TOTALE è il rapporto tra i totali, non la somma delle righe."""
+    anni = list(anni)
+    pivot_importi, pivot_titoli = pivot_per_servizio(cubo, 'Importo Totale'), pivot_per_servizio(cubo, 'Numero Titoli')
+    redditivita = (pivot_importi / pivot_titoli.replace(0, pd.NA)).reindex(columns=anni).fillna(0)
+    totale = {}
+    for anno in anni:
+        tot_imp, tot_tit = pivot_importi.get(anno, pd.Series(0)).sum(), pivot_titoli.get(anno, pd.Series(0)).sum()
+        totale[anno] = tot_imp / tot_tit if tot_tit > 0 else 0
+    for a, b, col_abs, col_pct in colonne_variazioni(anni):
+        redditivita[col_abs] = redditivita[b] - redditivita[a]
+        redditivita[col_pct] = (redditivita[col_abs] / redditivita[a].replace(0, pd.NA)) * 100
+        totale[col_abs] = totale[b] - totale[a]
+        totale[col_pct] = (totale[b] - totale[a]) / totale[a] * 100 if totale[a] > 0 else 0
+    redditivita_con_totale = pd.concat([redditivita, pd.DataFrame(totale, index=['TOTALE'])])
+    redditivita_con_totale.columns = [str(c) for c in redditivita_con_totale.columns]
+    return redditivita_con_totale
+
+
+def pivot_mensile(cubo, misura, vista, anni):
+    """Mesi (1-12) × Anni per la vista selezionata; compaiono solo i mesi con dati negli anni scelti."""
+    cubo = cubo[cubo['Anno'].isin(anni)]
+    pivot = pivot_cubo(filtra_servizi(cubo, vista), misura, 'Mese', 'Anno').reindex(columns=list(anni), fill_value=0)
+    return pivot.loc[pivot.index.isin(range(1, 13))]
+
+
+def tabella_mensile(cubo, misura, vista, anni):
+    """Confronto mensile (mesi per nome) con variazioni e riga TOTALE."""
+    pivot = pivot_mensile(cubo, misura, vista, anni)
+    pivot.index = pivot.index.map(NOMI_MESI)
+    return aggiungi_variazioni(pivot, anni)
+
+
+def riepilogo_anno(cubo, anno):
+    """Totali per servizio (tutti i servizi) e andamento mensile Mese × Servizio per un anno."""
+    cubo_anno = cubo[cubo['Anno'] == anno]
+    per_servizio = cubo_anno.groupby('Servizio', observed=False)[MISURE].sum().reindex(SERVIZI_ORDER, fill_value=0)
+    per_servizio.index = pd.CategoricalIndex(per_servizio.index, categories=SERVIZI_ORDER, ordered=True, name='Servizio')
+    andamento_mensile = pivot_cubo(cubo_anno, 'Importo Totale', 'Mese', 'Servizio').reindex(columns=SERVIZI_ORDER, fill_value=0)
+    andamento_mensile.columns = pd.CategoricalIndex(andamento_mensile.columns, categories=SERVIZI_ORDER, ordered=True, name='Servizio')
+    return per_servizio.reset_index(), andamento_mensile
+
+
+def dettaglio_anno(cubo, anno):
+    """Totali per servizio con quota sugli incassi e redditività media, più la riga TOTALE."""
+    dati_per_servizio, _ = riepilogo_anno(cubo, anno)
+    incasso_totale, transazioni_totali = dati_per_servizio['Importo Totale'].sum(), dati_per_servizio['Numero Titoli'].sum()
+    dati_per_servizio['Percentuale'] = (dati_per_servizio['Importo Totale'] / incasso_totale * 100) if incasso_totale > 0 else 0
+    dati_per_servizio['Redditività Media'] = (dati_per_servizio['Importo Totale'] / dati_per_servizio['Numero Titoli'].replace(0, pd.NA)).fillna(0)
+    riga_totale = pd.DataFrame({'Servizio': ['TOTALE'], 'Importo Totale': [incasso_totale], 'Numero Titoli': [transazioni_totali], 'Percentuale': [100.0], 'Redditività Media': [incasso_totale / transazioni_totali if transazioni_totali > 0 else 0]})
+    return pd.concat([dati_per_servizio, riga_totale], ignore_index=True)
+
+
+def finestra_mobile(cubo, misura, vista, mesi=12):
+    """Totale mobile su `mesi` mesi per la vista selezionata, confrontato con la stessa finestra dell'anno precedente.
+
+    I mesi senza dati restano vuoti: una finestra è calcolata solo se tutti i suoi mesi sono disponibili.
+    """
+    serie = filtra_servizi(cubo, vista).groupby(['Anno', 'Mese'])[misura].sum()
+    if serie.empty:
+        return pd.DataFrame(columns=['Totale Mobile', 'Anno Precedente', 'Variazione %'])
+    serie.index = pd.PeriodIndex([pd.Period(year=a, month=m, freq='M') for a, m in serie.index], name='Periodo')
+    serie = serie.reindex(pd.period_range(serie.index.min(), serie.index.max(), freq='M', name='Periodo'))
+    mobile = serie.rolling(mesi, min_periods=mesi).sum()
+    precedente = mobile.shift(12)
+    risultato = pd.DataFrame({'Totale Mobile': mobile, 'Anno Precedente': precedente, 'Variazione %': (mobile - precedente) / precedente.replace(0, pd.NA) * 100})
+    return risultato.dropna(subset=['Totale Mobile'])
@@ -0,0 +1,250 @@
+"""Benchmark della pipeline della dashboard su report sintetici, senza Streamlit né rete.
+
+Genera report `Riepilogo_*` per tutti i servizi su un numero di anni a scelta e misura, fase per
+fase, ingestione (a freddo e dalla cache Parquet), aggiornamento incrementale, tabelle, rendering
+HTML, figure Plotly e salvataggio delle note su un foglio Google Sheets finto (in memoria, con
+latenza simulata per chiamata API). Esempi:
+
+    python benchmark.py --anni 20 --ripetizioni 5 --json base.json
+    python benchmark.py --anni 20 --ripetizioni 5 --confronta base.json --soglia 0.25
+
+Con --confronta il comando esce con codice 1 se una fase è più lenta della base oltre la soglia.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import plotly.io as pio
+
+from aggregati import VISTE
+from formattazione import celle_tabella, tabella_html
+from grafici import figura_finestra, figura_mensile, figure_anno
+from ingestione import SERVIZI_FILENAME_MAP
+from motore import METRICHE, carica_cartella, sincronizza, tabelle_anno, tabelle_confronto
+from note import COLONNE_NOTE, ArchivioNote, FoglioNoteGSheets
+from strumentazione import Misuratore, fase
+
+PRIMO_ANNO = 2000
+# Prezzo medio per titolo di ogni servizio (solo per dare ai dati sintetici un ordine di grandezza credibile).
+PREZZI = {"Autorizzazioni": 25.0, "Abbonamenti": 40.0, "Parcometro": 1.1, "ParkingHUB": 1.4, "Tap&Park": 5.0}
+# Le fasi più brevi di così nella base non vengono confrontate: il rumore supererebbe la soglia.
+DURATA_MINIMA_CONFRONTO = 0.005
+
+
+# --- DATI SINTETICI ---
+def scrivi_riepilogo(percorso, righe):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['Mese', 'Numero Transazioni', 'Importo Totale'])
+    for riga in righe: ws.append(riga)
+    wb.save(percorso)
+
+
+def righe_sintetiche(nome_file, anni, mesi_ultimo_anno, seed=0):
+    """Righe (mese, titoli, importo) di un servizio: stagionalità, crescita annua e rumore riproducibili."""
+    rng = np.random.default_rng([seed, sum(map(ord, nome_file))])
+    righe = []
+    for i, anno in enumerate(range(PRIMO_ANNO, PRIMO_ANNO + anni)):
+        for mese in range(1, (mesi_ultimo_anno if i == anni - 1 else 12) + 1):
+            titoli = int(rng.normal(10000, 1500) * (1 + 0.03 * i) * (1 + 0.2 * np.sin(mese / 12 * 2 * np.pi)))
+            righe.append((f"{anno}-{mese:02d}", max(titoli, 0), round(max(titoli, 0) * PREZZI[nome_file] * rng.uniform(0.9, 1.1), 2)))
+    return righe
+
+
+def genera_cartella(cartella, anni, seed=0):
+    """Cartella con un report per servizio (l'ultimo anno si ferma a novembre) e un file di rettifiche."""
+    os.makedirs(cartella, exist_ok=True)
+    for nome_file in SERVIZI_FILENAME_MAP:
+        scrivi_riepilogo(os.path.join(cartella, f"Riepilogo_{nome_file}_Mensile.xlsx"), righe_sintetiche(nome_file, anni, 11, seed))
+    regole = [
+        {"id": "manuale", "tipo": "assoluta", "anno": PRIMO_ANNO, "mesi": [1, 2, 3], "servizio": "Hub Sosta (App)", "importo": 3130.5, "titoli": 1},
+        {"id": "leap", "tipo": "proporzionale", "anno": PRIMO_ANNO, "mesi": [2], "importo": -1350.84, "opzionale": True},
+    ]
+    with open(os.path.join(cartella, "rettifiche.json"), 'w', encoding='utf-8') as f:
+        json.dump({"rettifiche": regole}, f, indent=1)
+
+
+def aggiungi_mese(cartella, anni, seed=0):
+    """Completa dicembre dell'ultimo anno nel report dei parcometri (l'arrivo del report di fine mese)."""
+    scrivi_riepilogo(os.path.join(cartella, "Riepilogo_Parcometro_Mensile.xlsx"), righe_sintetiche("Parcometro", anni, 12, seed))
+
+
+# --- GOOGLE SHEETS FINTO ---
+class FoglioFinto:
+    """Foglio gspread in memoria: solo i metodi usati da FoglioNoteGSheets."""
+
+    def __init__(self, connessione, righe):
+        self.connessione, self.righe = connessione, [list(r) for r in righe]
+
+    def get_values(self):
+        self.connessione._chiamata('get_values')
+        return [r[:] for r in self.righe]
+
+    def append_row(self, riga, **_):
+        self.connessione._chiamata('append_row')
+        self.righe.append(list(riga))
+
+    def append_rows(self, righe, **_):
+        self.connessione._chiamata('append_rows')
+        self.righe += [list(r) for r in righe]
+
+    def batch_update(self, aggiornamenti, **_):
+        self.connessione._chiamata('batch_update')
+        for aggiornamento in aggiornamenti:
+            self.righe[int(aggiornamento['range'][1:]) - 1][2] = aggiornamento['values'][0][0]
+
+
+class ConnessioneGSheetsFinta:
+    """Sostituto in memoria di GSheetsConnection: conta le chiamate API e attende `latenza` secondi per ognuna."""
+
+    def __init__(self, righe_note=(), latenza=0.0):
+        self.latenza, self.chiamate = latenza, Counter()
+        self.fogli = {"notes": FoglioFinto(self, [COLONNE_NOTE, *righe_note])}
+        # Come per la connessione vera, il client gspread espone _select_worksheet e _open_spreadsheet.
+        self.client = self
+
+    def _chiamata(self, nome):
+        self.chiamate[nome] += 1
+        time.sleep(self.latenza)
+
+    def read(self, worksheet, usecols=None, ttl=None):
+        self._chiamata('read')
+        intestazione, *righe = self.fogli[worksheet].righe
+        df = pd.DataFrame(righe, columns=intestazione)
+        return df.iloc[:, usecols] if usecols is not None else df
+
+    def _select_worksheet(self, worksheet):
+        from gspread.exceptions import WorksheetNotFound
+        self._chiamata('select_worksheet')
+        if worksheet not in self.fogli: raise WorksheetNotFound(worksheet)
+        return self.fogli[worksheet]
+
+    def _open_spreadsheet(self):
+        return self
+
+    def add_worksheet(self, title, rows, cols):
+        self._chiamata('add_worksheet')
+        self.fogli[title] = FoglioFinto(self, [])
+        return self.fogli[title]
+
+
+# --- PROVE ---
+def prova_note(cartella, numero_note, latenza):
+    """Lettura del foglio, salvataggio di `numero_note` note (metà già presenti sul foglio) e invio in batch."""
+    esistenti = [("Incassi", f"riga {i}", "nota originale") for i in range(numero_note // 2)]
+    connessione = ConnessioneGSheetsFinta(esistenti, latenza)
+    archivio = ArchivioNote(os.path.join(cartella, "note.sqlite3"), FoglioNoteGSheets(connessione))
+    archivio.aggiorna_da_foglio(forza=True)
+    riferimento = archivio.carica()
+    note = {"Incassi": {f"riga {i}": f"nota {i}" for i in range(numero_note)}}
+    with fase("note: salvataggio locale"):
+        archivio.salva(note, riferimento)
+    with fase("note: invio a Google Sheets"):
+        archivio.sincronizza()
+    return sum(connessione.chiamate.values())
+
+
+def esegui_prova(base, cartella, anni, max_workers=None, numero_note=200, latenza=0.05):
+    """Una ripetizione completa della pipeline; `base` è la cartella generata, copiata in `cartella`."""
+    shutil.copytree(base, cartella)
+    with fase("ingestione a freddo (Excel)"):
+        carica_cartella(cartella, max_workers)
+    with fase("ingestione a caldo (cache Parquet)"):
+        aggregati = carica_cartella(cartella, max_workers)
+    with fase("rerun senza modifiche"):
+        sincronizza(aggregati, cartella, max_workers)
+    aggiungi_mese(cartella, anni)
+    with fase("aggiornamento incrementale (un mese)"):
+        sincronizza(aggregati, cartella, max_workers)
+    tutti, ultimo = tuple(aggregati.anni), aggregati.anni[-1]
+    with fase("tabelle"):
+        tabelle = tabelle_confronto(aggregati, tutti, ('leap',))
+        tabelle.update(tabelle_anno(aggregati, ultimo))
+    with fase("formattazione HTML"):
+        for tabella, formati in tabelle.values(): tabella_html(celle_tabella(tabella, formati))
+    with fase("grafici"):
+        figure = list(aggregati.calcola(figure_anno, ultimo, anni=(ultimo,)))
+        for metrica, (misura, _) in METRICHE.items():
+            for vista in VISTE:
+                figure.append(aggregati.calcola(figura_mensile, misura, vista, tutti, metrica, metrica, anni=tutti, attive=('leap',)))
+                figure.append(aggregati.calcola(figura_finestra, misura, vista, 12, metrica, metrica, anni=tutti, attive=('leap',)))
+        with fase("serializzazione Plotly"):
+            for fig in figure:
+                if fig is not None: pio.to_json(fig)
+    with fase("note (Google Sheets finto)"):
+        chiamate = prova_note(cartella, numero_note, latenza)
+    return {'righe_cubo': len(aggregati.cubo), 'tabelle': len(tabelle), 'figure': sum(f is not None for f in figure), 'chiamate_api_note': chiamate}
+
+
+def esegui(anni, ripetizioni, memoria=False, max_workers=None, numero_note=200, latenza=0.05):
+    """Esegue le ripetizioni e restituisce {'parametri', 'volumi', 'fasi'} con la mediana delle durate per fase."""
+    misure, volumi = [], None
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "base")
+        genera_cartella(base, anni)
+        for i in range(ripetizioni):
+            with Misuratore(memoria=memoria) as misuratore:
+                volumi = esegui_prova(base, os.path.join(tmp, f"prova_{i}"), anni, max_workers, numero_note, latenza)
+            misure.append(misuratore)
+    fasi = []
+    for nome in misure[0].fasi:
+        durate = [m.fasi[nome]['durata_s'] for m in misure if nome in m.fasi]
+        fasi.append({'fase': nome, 'chiamate': misure[0].fasi[nome]['chiamate'], 'mediana_s': statistics.median(durate),
+                     'min_s': min(durate), 'picco_memoria_mb': max(m.fasi[nome]['picco_memoria_mb'] for m in misure if nome in m.fasi)})
+    parametri = {'anni': anni, 'ripetizioni': ripetizioni, 'memoria': memoria, 'processi': max_workers, 'note': numero_note, 'latenza_api_s': latenza, 'cpu': os.cpu_count()}
+    return {'parametri': parametri, 'volumi': volumi, 'fasi': fasi}
+
+
+def confronta(risultati, base, soglia):
+    """Fasi più lente della base oltre `soglia` (frazione): [(fase, mediana base, mediana attuale)]."""
+    mediane_base = {f['fase']: f['mediana_s'] for f in base['fasi']}
+    return [(f['fase'], mediane_base[f['fase']], f['mediana_s']) for f in risultati['fasi']
+            if mediane_base.get(f['fase'], 0) >= DURATA_MINIMA_CONFRONTO and f['mediana_s'] > mediane_base[f['fase']] * (1 + soglia)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline della dashboard su report sintetici.")
+    parser.add_argument('--anni', type=int, default=10, help="anni di dati sintetici per servizio (default: 10)")
+    parser.add_argument('--ripetizioni', type=int, default=3, help="ripetizioni della pipeline; si riporta la mediana (default: 3)")
+    parser.add_argument('--memoria', action='store_true', help="misura anche il picco di memoria per fase (più lento)")
+    parser.add_argument('--processi', type=int, help="processi per il parsing dei report (default: numero di CPU)")
+    parser.add_argument('--note', type=int, default=200, help="note salvate nella prova di Google Sheets (default: 200)")
+    parser.add_argument('--latenza', type=float, default=0.05, help="latenza simulata di ogni chiamata API di Google Sheets, in secondi (default: 0.05)")
+    parser.add_argument('--json', help="salva i risultati in questo file")
+    parser.add_argument('--confronta', help="risultati JSON di riferimento con cui confrontare le mediane")
+    parser.add_argument('--soglia', type=float, default=0.2, help="rallentamento tollerato rispetto al riferimento (default: 0.2 = +20%%)")
+    args = parser.parse_args(argv)
+    if args.anni < 2 or args.ripetizioni < 1:
+        parser.error("servono almeno 2 anni e 1 ripetizione")
+    risultati = esegui(args.anni, args.ripetizioni, args.memoria, args.processi, args.note, args.latenza)
+    tabella = pd.DataFrame(risultati['fasi']).set_index('fase')
+    tabella[['mediana_s', 'min_s']] *= 1000
+    tabella = tabella.rename(columns={'mediana_s': 'mediana (ms)', 'min_s': 'min (ms)', 'picco_memoria_mb': 'picco memoria (MB)'})
+    if not args.memoria: tabella = tabella.drop(columns='picco memoria (MB)')
+    print(f"{args.anni} anni, {args.ripetizioni} ripetizioni: " + ", ".join(f"{v} {k.replace('_', ' ')}" for k, v in risultati['volumi'].items()))
+    print(tabella.to_string(float_format=lambda v: f"{v:.1f}"))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(risultati, f, indent=1, ensure_ascii=False)
+    if not args.confronta: return 0
+    with open(args.confronta, encoding='utf-8') as f:
+        base = json.load(f)
+    if base['parametri']['anni'] != args.anni:
+        print(f"[AVVISO] il riferimento usa {base['parametri']['anni']} anni di dati, non {args.anni}", file=sys.stderr)
+    regressioni = confronta(risultati, base, args.soglia)
+    for nome, prima, dopo in regressioni:
+        print(f"[REGRESSIONE] {nome}: {prima * 1000:.1f} ms -> {dopo * 1000:.1f} ms ({(dopo / prima - 1) * 100:+.0f}%)", file=sys.stderr)
+    return 1 if regressioni else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
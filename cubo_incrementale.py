@@ -0,0 +1,138 @@
+"""Cubo aggregato aggiornato in modo incrementale, report per report.
+
+Ogni report contribuisce un cubo parziale. Quando un report cambia (es. viene aggiunto un mese)
+si ricalcolano solo le celle Anno × Mese × Servizio che il report tocca, e solo gli anni le cui
+celle sono davvero cambiate ricevono una nuova versione. Le tabelle derivate sono memoizzate
+in base alle versioni degli anni che usano: aggiungere un mese del 2026 non ricalcola i
+confronti 2024 vs 2025.
+
+Un'istanza è condivisa tra le sessioni Streamlit (st.cache_resource): tutti gli accessi
+passano dal lock.
+"""
+import threading
+
+import pandas as pd
+
+from aggregati import DIMENSIONI, MISURE, costruisci_cubo, periodi_per_anno
+from ingestione import SERVIZI_ORDER
+from rettifiche import applica_rettifiche, prepara_rettifiche
+from strumentazione import fase
+
+# Oltre questa soglia la memoria delle tabelle derivate viene svuotata (le chiavi includono le versioni,
+# quindi le voci obsolete non verrebbero mai più lette).
+MAX_VOCI_MEMO = 512
+
+
+def _cubo_vuoto():
+    indice = pd.MultiIndex.from_tuples([], names=DIMENSIONI)
+    return pd.DataFrame({'Importo Totale': pd.Series(dtype='float64'), 'Numero Titoli': pd.Series(dtype='int64')}, index=indice)
+
+
+def _copia(risultato):
+    return risultato.copy() if isinstance(risultato, (pd.DataFrame, pd.Series)) else risultato
+
+
+class CuboIncrementale:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._report = {}          # nome report -> {'firma', 'cubo' (indicizzato), 'periodi'}
+        self._cubo = _cubo_vuoto()  # somma dei cubi parziali, indicizzata per (Anno, Mese, Servizio)
+        self.cubo = costruisci_cubo(pd.DataFrame(columns=DIMENSIONI + MISURE))
+        self.periodi = pd.DataFrame(columns=['min', 'max'])
+        self.versioni = {}         # Anno -> versione, incrementata quando cambia una cella dell'anno
+        self.versione = 0          # versione globale, incrementata a ogni modifica
+        self.regole, self.firma_regole = [], None
+        self.avvisi = {}           # nome report -> messaggio dell'ultimo errore di lettura
+        self._memo = {}
+
+    # --- SINCRONIZZAZIONE CON LA CARTELLA ---
+    def report_da_aggiornare(self, firma):
+        """Confronta la firma della cartella ((nome, mtime, dimensione), ...) con lo stato.
+
+        Restituisce ({nome: firma} dei report nuovi o modificati, [nomi dei report rimossi]).
+        """
+        firme = {nome: (mtime, dimensione) for nome, mtime, dimensione in firma}
+        modificati = {nome: f for nome, f in firme.items() if self._report.get(nome, {}).get('firma') != f}
+        return modificati, [nome for nome in self._report if nome not in firme]
+
+    def aggiorna_report(self, firme, frame, rimossi=()):
+        """Sostituisce i contributi dei report in `firme` con i `frame` letti e toglie quelli `rimossi`.
+
+        Un report presente in `firme` ma non in `frame` (illeggibile o non riconosciuto) contribuisce
+        un cubo vuoto: non viene riletto finché il file non cambia. Restituisce gli anni modificati.
+        """
+        toccate = []
+        for nome in rimossi:
+            vecchio = self._report.pop(nome, None)
+            if vecchio is not None: toccate.append(vecchio['cubo'].index)
+        for nome, firma in firme.items():
+            vecchio = self._report.get(nome)
+            if vecchio is not None: toccate.append(vecchio['cubo'].index)
+            df = frame.get(nome)
+            if df is None or df.empty:
+                self._report[nome] = {'firma': firma, 'cubo': _cubo_vuoto(), 'periodi': pd.DataFrame(columns=['min', 'max'])}
+                continue
+            parziale = costruisci_cubo(df).set_index(DIMENSIONI)
+            self._report[nome] = {'firma': firma, 'cubo': parziale, 'periodi': periodi_per_anno(df)}
+            toccate.append(parziale.index)
+        if not toccate: return set()
+        celle = toccate[0].append(toccate[1:]).unique() if len(toccate) > 1 else toccate[0].unique()
+        anni = self._ricalcola_celle(celle)
+        periodi = [r['periodi'] for r in self._report.values() if not r['periodi'].empty]
+        self.periodi = pd.concat(periodi).groupby(level=0).agg({'min': 'min', 'max': 'max'}) if periodi else pd.DataFrame(columns=['min', 'max'])
+        return anni
+
+    def _ricalcola_celle(self, celle):
+        """Ricalcola solo le celle indicate sommando i contributi dei report che le contengono."""
+        contributi = [r['cubo'].loc[r['cubo'].index.intersection(celle)] for r in self._report.values()]
+        contributi = [c for c in contributi if not c.empty]
+        nuove = pd.concat(contributi).groupby(level=DIMENSIONI, observed=True).sum() if contributi else _cubo_vuoto()
+        vecchie = self._cubo.loc[self._cubo.index.intersection(celle)]
+        self._cubo = pd.concat([self._cubo.drop(vecchie.index), nuove]).sort_index()
+        # Un anno cambia se una sua cella compare, scompare o cambia valore.
+        tutte = vecchie.index.union(nuove.index)
+        diverse = ~vecchie.reindex(tutte).eq(nuove.reindex(tutte)).all(axis=1)
+        anni = set(tutte[diverse.to_numpy()].get_level_values('Anno').astype(int))
+        if anni:
+            for anno in anni: self.versioni[anno] = self.versioni.get(anno, 0) + 1
+            self.versione += 1
+            self.cubo = self._cubo.reset_index().astype({'Anno': 'int32', 'Mese': 'int32'})
+            self.cubo['Servizio'] = pd.Categorical(self.cubo['Servizio'], categories=SERVIZI_ORDER, ordered=True)
+        return anni
+
+    def imposta_regole(self, firma, regole):
+        self.regole, self.firma_regole = regole, firma
+        self.versione += 1
+
+    # --- INTERROGAZIONI MEMOIZZATE ---
+    @property
+    def anni(self):
+        return sorted(int(a) for a in self.cubo['Anno'].unique())
+
+    def _memoizza(self, chiave, calcolo):
+        with self.lock:
+            if chiave not in self._memo:
+                if len(self._memo) >= MAX_VOCI_MEMO: self._memo.clear()
+                # Solo i calcoli veri e propri (memo mancante) compaiono come fasi.
+                with fase(f"calcolo {chiave[0]}"):
+                    self._memo[chiave] = calcolo()
+            risultato = self._memo[chiave]
+        # Le tabelle vengono modificate dai chiamanti (note, etichette dei mesi): si restituisce una copia.
+        # Gli altri risultati (es. le figure) sono condivisi e non vanno modificati.
+        if isinstance(risultato, tuple): return tuple(_copia(r) for r in risultato)
+        return _copia(risultato)
+
+    def _rettifiche(self):
+        return self._memoizza(('rettifiche', self.versione), lambda: prepara_rettifiche(self.cubo, self.regole))
+
+    def cubo_rettificato(self, attive=()):
+        """Cubo con le rettifiche sempre attive più quelle opzionali `attive`."""
+        def calcolo():
+            cubo_base, delta = self._rettifiche()
+            return applica_rettifiche(cubo_base, delta, attive)
+        return self._memoizza(('cubo', tuple(attive), self.versione), calcolo)
+
+    def calcola(self, funzione, *args, anni, attive=()):
+        """`funzione(cubo_rettificato, *args)` memoizzata sulle versioni dei soli `anni` da cui dipende."""
+        chiave = (funzione.__name__, args, tuple(attive), self.firma_regole, tuple((a, self.versioni.get(a, 0)) for a in anni))
+        return self._memoizza(chiave, lambda: funzione(self.cubo_rettificato(attive), *args))
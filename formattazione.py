@@ -0,0 +1,134 @@
+"""Formattazione vettoriale delle tabelle di confronto: numeri in formato italiano, colori e HTML.
+
+Al posto di pandas.Styler le celle con lo stesso formato vengono formattate insieme, con una
+sola passata sui valori dell'intera tabella. Le celle formattate non dipendono dalle note della
+sessione, quindi possono essere memoizzate con gli aggregati (CuboIncrementale.calcola): a ogni
+rerun resta solo da aggiungere la colonna Note e unire le righe.
+"""
+import html
+
+import numpy as np
+import pandas as pd
+
+from aggregati import colonne_variazioni, dettaglio_anno
+from strumentazione import fase
+
+# Stessi stili della vecchia versione con Styler.
+CSS_TABELLA = """<style>
+.tabella-confronto th, .tabella-confronto td { text-align: center; }
+.tabella-confronto td.positivo { color: green; }
+.tabella-confronto td.negativo { color: red; }
+.tabella-confronto td.nullo { color: grey; }
+.tabella-confronto tr.totale td { font-weight: bold; background-color: #D9E1F2; }
+.tabella-confronto td.nota { white-space: pre-wrap; text-align: left; min-width: 250px; }
+</style>"""
+
+# Formati della tabella di dettaglio annuale (aggregati.dettaglio_anno, indicizzata per servizio).
+FORMATI_DETTAGLIO_ANNO = {'Importo Totale': 'valuta', 'Numero Titoli': 'numero', 'Percentuale': 'quota', 'Redditività Media': 'valuta'}
+
+# Il formato inglese ('1,234.56') diventa italiano ('1.234,56') scambiando i due separatori.
+_SEPARATORI_ITALIANI = str.maketrans(',.', '.,')
+# Testo di una cella per ogni formato delle colonne, a partire da un float non mancante.
+_TESTO_CELLA = {
+    'valuta': lambda v: f"€ {v:,.2f}".translate(_SEPARATORI_ITALIANI),
+    'numero': lambda v: f"{v:,.0f}".replace(',', '.'),
+    'variazione_valuta': lambda v: ('+' if v >= 0 else '') + f"€ {v:,.2f}".translate(_SEPARATORI_ITALIANI),
+    'variazione_numero': lambda v: ('+' if v >= 0 else '') + f"{v:,.0f}".replace(',', '.'),
+    'percentuale': lambda v: f"{v:+.2f}%",
+    'quota': lambda v: f"{v:.2f}%",
+}
+
+
+# --- FORMATTAZIONE DEI VALORI ---
+def format_europeo(valore, tipo='valuta'):
+    """'€ 1.234,56' (valuta) o '1.235' (numero) per un singolo valore; 'N/A' se mancante."""
+    if pd.isna(valore): return "N/A"
+    try:
+        if tipo == 'valuta': return f"€ {valore:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        elif tipo == 'numero': return f"{valore:,.0f}".replace(",", ".")
+        return valore
+    except (ValueError, TypeError): return valore
+
+
+def _valori(dati):
+    """Valori float (NaN per i mancanti) di una colonna o di un gruppo di colonne, in un unico array."""
+    try:
+        return dati.to_numpy(dtype='float64', na_value=np.nan)
+    except (TypeError, ValueError):
+        return dati.apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+
+def formatta_europeo(serie, tipo='valuta'):
+    """format_europeo applicato a una colonna: '€ 1.234,56' o '1.235'; 'N/A' per i valori mancanti."""
+    testo = _TESTO_CELLA[tipo]
+    return pd.Series([testo(v) if v == v else 'N/A' for v in _valori(serie).tolist()], index=serie.index, dtype=object)
+
+
+def formati_confronto(anni, tipo):
+    """Formato di ogni colonna di una tabella di confronto: anni, variazioni assolute e percentuali."""
+    formati = {str(anno): tipo for anno in anni}
+    for _, _, col_abs, col_pct in colonne_variazioni(anni):
+        formati[col_abs], formati[col_pct] = f"variazione_{tipo}", 'percentuale'
+    return formati
+
+
+# --- CELLE E HTML ---
+def celle_tabella(df, formati):
+    """Celle <td> formattate. `formati` associa a ogni colonna 'valuta', 'numero', 'variazione_valuta',
+    'variazione_numero', 'percentuale' (colorata per segno) o 'quota'.
+
+    Le colonne con lo stesso formato sono formattate insieme, in un'unica passata sui valori: su
+    tabelle di poche righe il costo fisso di ogni operazione pandas supererebbe quello del lavoro.
+    """
+    with fase("formattazione celle"):
+        gruppi = {}
+        for colonna, formato in formati.items(): gruppi.setdefault(formato, []).append(colonna)
+        celle = {}
+        for formato, colonne in gruppi.items():
+            valori = _valori(df[colonne])
+            testo = _TESTO_CELLA[formato]
+            if formato == 'percentuale':
+                # Zero e valori mancanti sono grigi.
+                td = [f'<td class="{"positivo" if v > 0 else "negativo" if v < 0 else "nullo"}">{testo(v) if v == v else "N/A"}</td>' for v in valori.ravel().tolist()]
+            else:
+                td = [f'<td>{testo(v)}</td>' if v == v else '<td>N/A</td>' for v in valori.ravel().tolist()]
+            blocco = np.array(td, dtype=object).reshape(valori.shape)
+            for i, colonna in enumerate(colonne): celle[colonna] = blocco[:, i]
+        return pd.DataFrame({colonna: celle[colonna] for colonna in formati}, index=df.index)
+
+
+def celle_confronto(cubo, tabella, tipo, *args):
+    """Celle di `tabella(cubo, *args)`, dove l'ultimo argomento sono gli anni confrontati.
+
+    Pensata per CuboIncrementale.calcola, che memoizza il risultato per versione degli aggregati.
+    """
+    return celle_tabella(tabella(cubo, *args), formati_confronto(args[-1], tipo))
+
+
+def celle_dettaglio_anno(cubo, anno):
+    """Celle del dettaglio annuale per servizio con la riga TOTALE; come celle_confronto, da memoizzare con gli aggregati."""
+    return celle_tabella(dettaglio_anno(cubo, anno).set_index('Servizio'), FORMATI_DETTAGLIO_ANNO)
+
+
+def tabella_html(celle, note=None, riga_evidenziata='TOTALE', css=True):
+    """HTML della tabella; `note` (allineata alle righe di `celle`) aggiunge la colonna Note.
+
+    Con css=False lo stile (CSS_TABELLA) va incluso una volta sola dal chiamante, es. in una pagina con più tabelle.
+    """
+    with fase("rendering HTML tabelle"):
+        return _tabella_html(celle, note, riga_evidenziata, css)
+
+
+def _tabella_html(celle, note, riga_evidenziata, css):
+    intestazione = '<th>&nbsp;</th>' + ''.join(f"<th>{html.escape(str(c))}</th>" for c in celle.columns)
+    if note is not None:
+        intestazione += '<th>Note</th>'
+        note = ['' if pd.isna(n) else html.escape(str(n)) for n in note]
+    righe = []
+    for i, (etichetta, valori) in enumerate(zip(celle.index, celle.to_numpy().tolist())):
+        apertura = '<tr class="totale">' if etichetta == riga_evidenziata else '<tr>'
+        nota = f'<td class="nota">{note[i]}</td>' if note is not None else ''
+        righe.append(f"{apertura}<th>{html.escape(str(etichetta))}</th>{''.join(valori)}{nota}</tr>")
+    corpo = '\n'.join(righe)
+    tabella = f'<table class="tabella-confronto">\n<thead><tr>{intestazione}</tr></thead>\n<tbody>\n{corpo}\n</tbody>\n</table>'
+    return f'{CSS_TABELLA}\n{tabella}' if css else tabella
@@ -0,0 +1,172 @@
+"""Generatore di report senza interfaccia: tabelle di confronto e dettaglio annuale in XLSX, CSV e HTML.
+
+Esempio, report di fine mese di due comuni elaborati in parallelo:
+
+    python genera_report.py dati/Falconara dati/Chiaravalle --anni 2024 2025 --formati xlsx html --uscita report
+
+Ogni cartella di dati (un comune) produce una sottocartella di `--uscita` con report.xlsx,
+report.html e un CSV per tabella. Le cartelle sono elaborate in processi separati; la cache
+Parquet di ogni cartella viene riutilizzata, quindi un batch notturno rilegge solo i report
+cambiati dall'esecuzione precedente.
+"""
+import argparse
+import html
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from openpyxl.styles import Font
+
+from formattazione import CSS_TABELLA, celle_tabella, tabella_html
+from motore import carica_cartella, tabelle_anno, tabelle_confronto
+
+FORMATI = ('xlsx', 'csv', 'html')
+# Formati numerici di Excel corrispondenti ai formati delle colonne (i separatori seguono le impostazioni locali).
+FORMATI_EXCEL = {
+    'valuta': '€ #,##0.00', 'variazione_valuta': '+€ #,##0.00;€ -#,##0.00', 'numero': '#,##0',
+    'variazione_numero': '+#,##0;-#,##0', 'percentuale': '+0.00"%";-0.00"%"', 'quota': '0.00"%"',
+}
+# Decimali dei valori scritti nei file, come nelle tabelle della dashboard (2 per gli altri formati).
+DECIMALI = {'numero': 0, 'variazione_numero': 0}
+
+
+# --- SCRITTURA DEI FORMATI ---
+def nome_foglio(titolo, usati):
+    """Nome di foglio Excel valido (al massimo 31 caratteri, senza []:*?/\\) e non ancora usato."""
+    base = re.sub(r'[\[\]:*?/\\]', '', titolo)[:31].rstrip()
+    nome, n = base, 2
+    while nome in usati:
+        suffisso = f" ({n})"
+        nome, n = base[:31 - len(suffisso)] + suffisso, n + 1
+    usati.add(nome)
+    return nome
+
+
+def nome_file(titolo):
+    return re.sub(r'\W+', '_', titolo).strip('_')
+
+
+def valori_arrotondati(tabella, formati):
+    """Tabella numerica con ogni colonna arrotondata ai decimali del suo formato (interi per i conteggi)."""
+    valori = tabella.apply(pd.to_numeric, errors='coerce')
+    for i, colonna in enumerate(valori.columns):
+        decimali = DECIMALI.get(formati.get(colonna), 2)
+        serie = valori.iloc[:, i].round(decimali)
+        valori.isetitem(i, serie.astype('Int64') if decimali == 0 else serie)
+    return valori
+
+
+def scrivi_xlsx(tabelle, percorso):
+    usati = set()
+    with pd.ExcelWriter(percorso, engine='openpyxl') as writer:
+        for titolo, (tabella, formati) in tabelle.items():
+            foglio = nome_foglio(titolo, usati)
+            valori_arrotondati(tabella, formati).to_excel(writer, sheet_name=foglio, startrow=1)
+            ws = writer.sheets[foglio]
+            ws.cell(row=1, column=1, value=titolo).font = Font(bold=True)
+            for i, colonna in enumerate(tabella.columns, start=2):
+                formato = FORMATI_EXCEL.get(formati.get(colonna))
+                if not formato: continue
+                for (cella,) in ws.iter_rows(min_row=3, min_col=i, max_col=i):
+                    cella.number_format = formato
+    return [percorso]
+
+
+def scrivi_csv(tabelle, cartella):
+    """Un CSV per tabella, con ';' e la virgola decimale (apribile direttamente in Excel in italiano)."""
+    os.makedirs(cartella, exist_ok=True)
+    scritti = []
+    for titolo, (tabella, formati) in tabelle.items():
+        percorso = os.path.join(cartella, nome_file(titolo) + ".csv")
+        valori_arrotondati(tabella, formati).to_csv(percorso, sep=';', decimal=',', encoding='utf-8-sig')
+        scritti.append(percorso)
+    return scritti
+
+
+def scrivi_html(tabelle, percorso, intestazione):
+    sezioni = [f"<h2>{html.escape(titolo)}</h2>\n{tabella_html(celle_tabella(tabella, formati), css=False)}" for titolo, (tabella, formati) in tabelle.items()]
+    pagina = f"""<!DOCTYPE html>
+<html lang="it"><head><meta charset="utf-8"><title>{html.escape(intestazione)}</title>
+{CSS_TABELLA}</head>
+<body><h1>{html.escape(intestazione)}</h1>
+{chr(10).join(sezioni)}
+</body></html>
+"""
+    with open(percorso, 'w', encoding='utf-8') as f:
+        f.write(pagina)
+    return [percorso]
+
+
+# --- ESPORTAZIONE ---
+def esporta_cartella(data_folder, cartella_uscita, anni=None, formati=FORMATI, attive=(), max_workers=None):
+    """Carica una cartella di dati ed esporta tabelle di confronto e dettaglio di ogni anno.
+
+    Gira anche nei processi worker. Restituisce (file scritti, avvisi); solleva un'eccezione se la
+    cartella non contiene dati validi o se una rettifica richiesta non esiste.
+    """
+    aggregati = carica_cartella(data_folder, max_workers)
+    if aggregati.cubo.empty:
+        raise ValueError(f"nessun file di riepilogo valido in '{data_folder}'")
+    avvisi = list(aggregati.avvisi.values())
+    disponibili = aggregati.anni
+    anni = tuple(sorted(anni)) if anni else tuple(disponibili[-2:])
+    avvisi += [f"Nessun dato disponibile per l'anno {anno}." for anno in anni if anno not in disponibili]
+    opzionali = {r['id'] for r in aggregati.regole if r['opzionale']}
+    if set(attive) - opzionali:
+        raise ValueError(f"rettifiche sconosciute: {', '.join(sorted(set(attive) - opzionali))} (disponibili: {', '.join(sorted(opzionali)) or 'nessuna'})")
+    tabelle = tabelle_confronto(aggregati, anni, tuple(attive))
+    for anno in anni:
+        if anno in disponibili: tabelle.update(tabelle_anno(aggregati, anno))
+    os.makedirs(cartella_uscita, exist_ok=True)
+    intestazione = f"{os.path.basename(os.path.normpath(data_folder))} - Confronto {' vs '.join(str(a) for a in anni)}"
+    scritti = []
+    if 'xlsx' in formati: scritti += scrivi_xlsx(tabelle, os.path.join(cartella_uscita, "report.xlsx"))
+    if 'csv' in formati: scritti += scrivi_csv(tabelle, os.path.join(cartella_uscita, "csv"))
+    if 'html' in formati: scritti += scrivi_html(tabelle, os.path.join(cartella_uscita, "report.html"), intestazione)
+    return scritti, avvisi
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Esporta le tabelle della dashboard per una o più cartelle di dati (una per comune).")
+    parser.add_argument('cartelle', nargs='+', help="cartelle con i report (come data_sources)")
+    parser.add_argument('--anni', nargs='+', type=int, help="anni da confrontare (default: gli ultimi due disponibili)")
+    parser.add_argument('--formati', nargs='+', choices=FORMATI, default=list(FORMATI))
+    parser.add_argument('--uscita', default="report", help="cartella di destinazione (default: report)")
+    parser.add_argument('--rettifiche', nargs='*', default=[], help="id delle rettifiche opzionali da applicare (es. leap)")
+    parser.add_argument('--processi', type=int, help="numero massimo di processi (default: numero di CPU)")
+    args = parser.parse_args(argv)
+    nomi = [os.path.basename(os.path.normpath(c)) for c in args.cartelle]
+    if len(set(nomi)) != len(nomi):
+        parser.error("le cartelle dei dati devono avere nomi diversi (danno il nome alle cartelle di uscita)")
+    lavori = {cartella: os.path.join(args.uscita, nome) for cartella, nome in zip(args.cartelle, nomi)}
+    processi = min(len(lavori), args.processi or os.cpu_count() or 1)
+    risultati = {}
+    if processi == 1:
+        # Una cartella alla volta: il parallelismo resta alla lettura dei report.
+        for cartella, uscita in lavori.items():
+            try:
+                risultati[cartella] = esporta_cartella(cartella, uscita, args.anni, args.formati, args.rettifiche, args.processi)
+            except Exception as e:
+                risultati[cartella] = e
+    else:
+        # Una cartella per processo, con la lettura dei report in serie dentro ciascun processo.
+        with ProcessPoolExecutor(max_workers=processi, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {cartella: pool.submit(esporta_cartella, cartella, uscita, args.anni, args.formati, args.rettifiche, 1) for cartella, uscita in lavori.items()}
+        risultati = {cartella: (f.exception() or f.result()) for cartella, f in futures.items()}
+    errori = 0
+    for cartella, risultato in risultati.items():
+        if isinstance(risultato, Exception):
+            print(f"[ERRORE] {cartella}: {risultato}", file=sys.stderr)
+            errori += 1
+            continue
+        scritti, avvisi = risultato
+        for avviso in avvisi: print(f"[AVVISO] {cartella}: {avviso}", file=sys.stderr)
+        print(f"{cartella}: {len(scritti)} file in {lavori[cartella]}")
+    return 1 if errori else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Grafici della dashboard, costruiti a partire dal cubo aggregato.
+
+Le funzioni sono pensate per CuboIncrementale.calcola: le figure vengono memoizzate per
+(anno o anni, vista, metrica, rettifiche attive) e per versione dei dati, quindi un rerun
+con gli stessi input (es. il click su una checkbox di un'altra sezione) non ricostruisce
+né rifà il melt dei dati. Prima di essere restituite le figure vengono rese compatte: gli
+array a valori interi viaggiano come interi invece che float64, e le serie giornaliere troppo
+lunghe vengono aggregate per settimana o per mese.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from aggregati import NOMI_MESI, finestra_mobile, pivot_mensile, riepilogo_anno
+from formattazione import formatta_europeo
+
+# Oltre questo numero di punti una serie temporale giornaliera viene aggregata prima di essere disegnata.
+MAX_PUNTI_SERIE = 500
+NOMI_MESI_BREVI = {m: nome[:3] for m, nome in NOMI_MESI.items()}
+
+
+# --- RIDUZIONE DEI DATI ---
+def riduci_serie(df, max_punti=MAX_PUNTI_SERIE):
+    """Aggrega (somma) per settimana, o per mese, le serie con indice giornaliero troppo lunghe."""
+    if not isinstance(df.index, pd.DatetimeIndex) or len(df) <= max_punti: return df
+    for frequenza in ('W', 'MS'):
+        ridotta = df.resample(frequenza).sum(min_count=1)
+        if len(ridotta) <= max_punti: break
+    return ridotta
+
+
+def compatta(fig):
+    """Converte in interi gli array float a valori interi delle tracce (es. numero titoli).
+
+    Plotly serializza gli array interi in base64 con il tipo più piccolo sufficiente (int8/16/32)
+    invece di float64: il payload inviato al browser si riduce da 2 a 8 volte.
+    """
+    for traccia in fig.data:
+        for attributo in ('x', 'y', 'values'):
+            valori = traccia[attributo] if attributo in traccia else None
+            if valori is None: continue
+            valori = np.asarray(valori)
+            if valori.dtype.kind != 'f' or not len(valori) or not np.isfinite(valori).all(): continue
+            if (valori == np.round(valori)).all() and np.abs(valori).max() < 2 ** 31:
+                # Plotly riscrive sul posto un array della stessa forma mantenendone il tipo: va prima azzerato.
+                traccia[attributo] = None
+                traccia[attributo] = valori.astype('int64')
+    return fig
+
+
+# --- FIGURE ---
+def figure_anno(cubo, anno):
+    """Torta, barre e andamento mensile per servizio del dettaglio annuale."""
+    dati_per_servizio, andamento_mensile = riepilogo_anno(cubo, anno)
+    fig_pie = px.pie(dati_per_servizio, names='Servizio', values='Importo Totale', title=f'Distribuzione Incassi {anno}', hole=0.3)
+    fig_pie.update_traces(textposition='inside', textinfo='percent+label', sort=False)
+    fig_bar = px.bar(dati_per_servizio, x='Servizio', y='Importo Totale', title=f'Incassi per Servizio {anno}', text_auto=False)
+    fig_bar.update_traces(texttemplate=formatta_europeo(dati_per_servizio['Importo Totale']).tolist(), textposition="outside")
+    df_plot = andamento_mensile.reset_index().melt(id_vars='Mese', var_name='Servizio', value_name='Importo')
+    df_plot['MeseStr'] = df_plot['Mese'].map(NOMI_MESI_BREVI)
+    fig_line = px.line(df_plot, x='MeseStr', y='Importo', color='Servizio', title=f'Andamento Incassi Mensili per Servizio - {anno}', markers=True, labels={"Importo": "Incasso (€)", "MeseStr": "Mese", "Servizio": "Servizio"})
+    return compatta(fig_pie), compatta(fig_bar), compatta(fig_line)
+
+
+def figura_mensile(cubo, misura, vista, anni, metrica, y_label):
+    """Confronto mese per mese degli anni selezionati."""
+    df_plot = pivot_mensile(cubo, misura, vista, anni)
+    df_plot.index = df_plot.index.map(NOMI_MESI)
+    df_plot.columns = [str(c) for c in df_plot.columns]
+    fig = px.line(riduci_serie(df_plot), title=f"Confronto Mensile {metrica} per: {vista}", markers=True, labels={"value": y_label, "index": "Mese", "variable": "Anno"})
+    fig.update_layout(yaxis_title=y_label, xaxis_title="Mese")
+    return compatta(fig)
+
+
+def figura_finestra(cubo, misura, vista, mesi, metrica, y_label):
+    """Totale mobile su `mesi` mesi contro lo stesso periodo dell'anno precedente; None se i dati non bastano."""
+    finestra = finestra_mobile(cubo, misura, vista, mesi).dropna(subset=['Anno Precedente'])
+    if finestra.empty: return None
+    df_plot = finestra[['Totale Mobile', 'Anno Precedente']].rename(columns={'Totale Mobile': f'Ultimi {mesi} mesi', 'Anno Precedente': 'Stessi mesi anno precedente'})
+    df_plot.index = df_plot.index.astype(str)
+    fig = px.line(df_plot, title=f"{metrica} su {mesi} mesi mobili per: {vista}", markers=True, labels={"value": y_label, "Periodo": "Fine finestra", "variable": ""})
+    fig.update_layout(yaxis_title=y_label, xaxis_title="Fine finestra")
+    return compatta(fig)
+
+
+def figure_transazioni(giornaliero, orario, anno):
+    """Titoli per giorno e profilo orario medio (picchi di utilizzo) dai rollup delle transazioni.
+
+    Pensata per ArchivioTransazioni.calcola, che la memoizza per firma delle partizioni dell'anno.
+    """
+    fig_giorni = px.line(riduci_serie(giornaliero[['Numero Titoli']]), y='Numero Titoli', title=f'Titoli Giornalieri - {anno}', labels={"Periodo": "Giorno"})
+    giorni = max(len(giornaliero), 1)
+    profilo = (orario.groupby(orario.index.hour)['Numero Titoli'].sum() / giorni).reindex(range(24), fill_value=0).rename_axis('Ora').reset_index()
+    fig_ore = px.bar(profilo, x='Ora', y='Numero Titoli', title=f'Titoli Medi per Ora del Giorno - {anno}', labels={"Numero Titoli": "Titoli medi al giorno"})
+    return compatta(fig_giorni), compatta(fig_ore)
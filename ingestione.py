@@ -0,0 +1,214 @@
+"""Ingestione dei report mensili: parsing in streaming con openpyxl e cache Parquet per file.
+
+Il modulo non dipende da Streamlit: le funzioni di parsing girano anche nei processi worker.
+"""
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import openpyxl
+import pandas as pd
+
+SERVIZI_ORDER = ["Autorizzazioni", "Abbonamenti", "Parcometri", "Hub Sosta (App)", "Tap&Park (ricariche)"]
+SERVIZI_FILENAME_MAP = {
+    "Autorizzazioni": "Autorizzazioni", "Abbonamenti": "Abbonamenti",
+    "Parcometro": "Parcometri", "ParkingHUB": "Hub Sosta (App)", "Tap&Park": "Tap&Park (ricariche)"
+}
+REPORT_PATTERN = re.compile(r'Riepilogo_(.+)_(?:Mensile)\.xlsx$', re.IGNORECASE)
+# Export delle singole transazioni (vedi transazioni.py): Transazioni_<Servizio>[_<qualsiasi>].xlsx|csv
+TRANSAZIONI_PATTERN = re.compile(r'Transazioni_([^_]+)(?:_.*)?\.(?:xlsx|csv)$', re.IGNORECASE)
+
+# Sotto questa dimensione complessiva dei file da leggere il parsing resta nel processo corrente: ogni
+# worker è un interprete nuovo che deve importare pandas e openpyxl, e l'avvio del pool costa più del parsing.
+SOGLIA_PARALLELO_BYTE = 4 * 2 ** 20
+
+# Colonne del report -> colonne del frame tipizzato ("Numero Transazioni" è il nome usato nei file).
+COLONNE_REPORT = {'Mese': 'Mese', 'Importo Totale': 'Importo Totale', 'Numero Transazioni': 'Numero Titoli', 'Numero Titoli': 'Numero Titoli'}
+
+
+def classifica_file(filename):
+    """('riepilogo' o 'transazioni', servizio) per i file di dati riconosciuti, altrimenti None."""
+    for tipo, pattern in (('riepilogo', REPORT_PATTERN), ('transazioni', TRANSAZIONI_PATTERN)):
+        match = pattern.match(filename)
+        if match and match.group(1) in SERVIZI_FILENAME_MAP: return tipo, SERVIZI_FILENAME_MAP[match.group(1)]
+    return None
+
+
+# --- PARSING IN STREAMING ---
+def leggi_report(percorso, servizio):
+    """Legge un report in modalità read-only e restituisce un frame tipizzato."""
+    return frame_tipizzato(leggi_colonne(percorso, COLONNE_REPORT, ['Mese', 'Importo Totale', 'Numero Titoli']), servizio)
+
+
+def leggi_colonne(percorso, mappa, obbligatorie):
+    """Colonne del primo foglio indicate in `mappa` (nome nel file -> nome interno), come liste.
+
+    Le righe vengono lette una alla volta e si conservano solo le colonne utili, quindi
+    il workbook non viene mai caricato per intero in memoria.
+    """
+    wb = openpyxl.load_workbook(percorso, read_only=True, data_only=True)
+    try:
+        righe = wb.worksheets[0].iter_rows(values_only=True)
+        intestazione = next(righe, ())
+        posizioni = {mappa[str(nome).strip()]: i for i, nome in enumerate(intestazione) if str(nome).strip() in mappa}
+        mancanti = set(obbligatorie) - set(posizioni)
+        if mancanti:
+            raise ValueError(f"colonne mancanti: {', '.join(sorted(mancanti))}")
+        colonne = {nome: [] for nome in posizioni}
+        for riga in righe:
+            if all(v is None for v in riga): continue
+            for nome, i in posizioni.items():
+                colonne[nome].append(riga[i] if i < len(riga) else None)
+    finally:
+        wb.close()
+    return colonne
+
+
+def frame_tipizzato(colonne, servizio):
+    """Costruisce il frame con `Servizio` categorico e `Anno`/`Mese` int32 a partire dalle colonne grezze."""
+    date = pd.to_datetime(pd.Series(colonne['Mese'], dtype=object).astype(str) + '-01')
+    return pd.DataFrame({
+        'DATA_ORA_INSERIMENTO': date,
+        'Anno': date.dt.year.astype('int32'),
+        'Mese': date.dt.month.astype('int32'),
+        'Servizio': pd.Categorical([servizio] * len(date), categories=SERVIZI_ORDER, ordered=True),
+        'Importo Totale': pd.to_numeric(pd.Series(colonne['Importo Totale'], dtype=object)).astype('float64'),
+        'Numero Titoli': pd.to_numeric(pd.Series(colonne['Numero Titoli'], dtype=object)),
+    })
+
+
+def _dimensione(percorso):
+    try:
+        return os.path.getsize(percorso)
+    except OSError:
+        return 0
+
+
+def leggi_report_in_parallelo(lavori, max_workers=None, soglia_byte=SOGLIA_PARALLELO_BYTE):
+    """Legge più report contemporaneamente in un pool di processi.
+
+    `lavori` è una lista di (funzione, percorso, *argomenti), es. (leggi_report, percorso, servizio);
+    la funzione deve essere definita a livello di modulo. Restituisce {percorso: frame o eccezione},
+    così un file illeggibile non blocca gli altri. Con un solo file, max_workers=1 o file che in
+    tutto pesano meno di `soglia_byte` il parsing avviene nel processo corrente.
+    """
+    if len(lavori) <= 1 or (max_workers or os.cpu_count() or 1) == 1 or sum(_dimensione(percorso) for _, percorso, *_ in lavori) < soglia_byte:
+        return _leggi_in_serie(lavori)
+    try:
+        # "spawn": il server Streamlit è multithread, e fare fork di un processo con thread attivi non è sicuro.
+        with ProcessPoolExecutor(max_workers=max_workers or min(len(lavori), os.cpu_count()), mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {percorso: pool.submit(funzione, percorso, *argomenti) for funzione, percorso, *argomenti in lavori}
+        risultati = {percorso: (f.exception() or f.result()) for percorso, f in futures.items()}
+    except (OSError, BrokenProcessPool):
+        risultati = {percorso: BrokenProcessPool() for _, percorso, *_ in lavori}
+    # Se il pool non è utilizzabile (es. worker non avviabili) i report coinvolti vengono letti in serie.
+    da_ripetere = [lavoro for lavoro in lavori if isinstance(risultati[lavoro[1]], BrokenProcessPool)]
+    risultati.update(_leggi_in_serie(da_ripetere))
+    return risultati
+
+
+def _leggi_in_serie(lavori):
+    risultati = {}
+    for funzione, percorso, *argomenti in lavori:
+        try:
+            risultati[percorso] = funzione(percorso, *argomenti)
+        except Exception as e:
+            risultati[percorso] = e
+    return risultati
+
+
+# --- CACHE COLONNARE (PARQUET) DEI REPORT ---
+# Ogni report Excel viene convertito una sola volta in Parquet. L'indice registra percorso, mtime e hash
+# del contenuto: un file viene riletto con openpyxl solo se è stato davvero modificato.
+CARTELLA_CACHE = ".cache_report"
+INDICE_CACHE = "indice.json"
+# Sottocartella della cache con le transazioni partizionate per mese (AAAA-MM/<file>.parquet).
+CARTELLA_TRANSAZIONI = "transazioni"
+# Da incrementare quando cambia il formato dei frame salvati (o il modo di leggerli): invalida tutte le voci esistenti.
+VERSIONE_CACHE = 3
+
+def hash_contenuto(percorso):
+    h = hashlib.sha256()
+    with open(percorso, 'rb') as f:
+        for blocco in iter(lambda: f.read(1 << 20), b''):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+def firma_report(data_folder):
+    """Firma leggera (nome, mtime, dimensione) dei report: usata come chiave di st.cache_data."""
+    if not os.path.exists(data_folder): return ()
+    firma = []
+    for filename in sorted(os.listdir(data_folder)):
+        if not classifica_file(filename): continue
+        stat = os.stat(os.path.join(data_folder, filename))
+        firma.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(firma)
+
+
+def carica_indice_cache(cartella_cache):
+    try:
+        with open(os.path.join(cartella_cache, INDICE_CACHE), encoding='utf-8') as f:
+            indice = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return indice.get('report', {}) if indice.get('versione') == VERSIONE_CACHE else {}
+
+
+def salva_indice_cache(cartella_cache, indice):
+    percorso = os.path.join(cartella_cache, INDICE_CACHE)
+    with open(percorso + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({'versione': VERSIONE_CACHE, 'report': indice}, f, indent=1)
+    os.replace(percorso + ".tmp", percorso)
+
+
+def nome_parquet(percorso):
+    """Nome del file Parquet associato a un report (in cache e nelle partizioni delle transazioni)."""
+    return hashlib.sha1(os.path.abspath(percorso).encode()).hexdigest()[:16] + ".parquet"
+
+
+def _percorso_parquet(cartella_cache, chiave):
+    return os.path.join(cartella_cache, nome_parquet(chiave))
+
+
+def leggi_da_cache(percorso, cartella_cache, indice):
+    """Restituisce il frame in cache se il report non è cambiato, altrimenti None."""
+    chiave = os.path.abspath(percorso)
+    stat = os.stat(percorso)
+    voce = indice.get(chiave)
+    percorso_parquet = _percorso_parquet(cartella_cache, chiave)
+    if not voce or not os.path.exists(percorso_parquet):
+        return None
+    if (voce['mtime_ns'], voce['dimensione']) == (stat.st_mtime_ns, stat.st_size):
+        return pd.read_parquet(percorso_parquet)
+    # File "toccato" ma con lo stesso contenuto (es. copiato di nuovo): basta aggiornare l'indice.
+    if voce['sha256'] == hash_contenuto(percorso):
+        voce.update(mtime_ns=stat.st_mtime_ns, dimensione=stat.st_size)
+        return pd.read_parquet(percorso_parquet)
+    return None
+
+
+def scrivi_in_cache(percorso, df, cartella_cache, indice):
+    chiave = os.path.abspath(percorso)
+    stat = os.stat(percorso)
+    percorso_parquet = _percorso_parquet(cartella_cache, chiave)
+    try:
+        df.to_parquet(percorso_parquet, index=False)
+        indice[chiave] = {'parquet': os.path.basename(percorso_parquet), 'mtime_ns': stat.st_mtime_ns, 'dimensione': stat.st_size, 'sha256': hash_contenuto(percorso)}
+    except Exception:
+        # Colonne con tipi non serializzabili: il report resta valido, semplicemente non viene messo in cache.
+        indice.pop(chiave, None)
+
+
+def pulisci_cache(data_folder, cartella_cache, indice):
+    """Elimina le voci (e i Parquet, comprese le partizioni delle transazioni) dei report non più presenti."""
+    presenti = {os.path.abspath(os.path.join(data_folder, f)) for f in os.listdir(data_folder)}
+    for chiave in [k for k in indice if k not in presenti]:
+        nome = indice.pop(chiave)['parquet']
+        for percorso_parquet in [os.path.join(cartella_cache, nome), *glob.glob(os.path.join(cartella_cache, CARTELLA_TRANSAZIONI, '*', nome))]:
+            if os.path.exists(percorso_parquet): os.remove(percorso_parquet)
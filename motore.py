@@ -0,0 +1,133 @@
+"""Motore della dashboard, senza Streamlit: caricamento di una cartella di report e tabelle di confronto.
+
+Lo usano sia l'app (che condivide lo stato tra le sessioni con st.cache_resource) sia il
+generatore di report da riga di comando (genera_report.py).
+"""
+import os
+
+from aggregati import (
+    NOMI_MESI, VISTE, dettaglio_anno, riepilogo_anno, tabella_confronto_servizi, tabella_mensile, tabella_redditivita
+)
+from cubo_incrementale import CuboIncrementale
+from formattazione import FORMATI_DETTAGLIO_ANNO, formati_confronto
+from ingestione import (
+    CARTELLA_CACHE, CARTELLA_TRANSAZIONI, SERVIZI_ORDER, carica_indice_cache, classifica_file, firma_report,
+    leggi_da_cache, leggi_report, leggi_report_in_parallelo, pulisci_cache, salva_indice_cache, scrivi_in_cache
+)
+from rettifiche import FILE_RETTIFICHE, carica_regole, firma_rettifiche
+from strumentazione import fase
+from transazioni import importa_transazioni
+
+# Metriche del confronto mensile: etichetta -> (misura del cubo, formato dei valori).
+METRICHE = {'Incasso Totale': ('Importo Totale', 'valuta'), 'Numero Titoli': ('Numero Titoli', 'numero')}
+
+
+# --- CARICAMENTO ---
+def leggi_report_cartella(data_folder, nomi, max_workers=None):
+    """Legge i report indicati: dalla cache Parquet se invariati, altrimenti dall'Excel (in parallelo).
+
+    Restituisce ({nome: frame tipizzato}, {nome: messaggio di errore}). Se la cache non si può creare
+    (es. cartella dei dati in sola lettura) i report vengono letti senza cache.
+    """
+    frame_per_report, errori, da_leggere = {}, {}, []
+    cartella_cache = os.path.join(data_folder, CARTELLA_CACHE)
+    try:
+        os.makedirs(cartella_cache, exist_ok=True)
+    except OSError as e:
+        cartella_cache = None
+        errori['cache'] = f"Cache dei report non disponibile, i file vengono letti senza cache: {e}"
+    indice = carica_indice_cache(cartella_cache) if cartella_cache else {}
+    for filename in sorted(nomi):
+        classificazione = classifica_file(filename)
+        if not classificazione: continue
+        tipo, servizio_nome = classificazione
+        percorso = os.path.join(data_folder, filename)
+        try:
+            with fase("lettura cache Parquet"):
+                df = leggi_da_cache(percorso, cartella_cache, indice) if cartella_cache else None
+        except Exception:
+            df = None
+        if df is not None: frame_per_report[filename] = df
+        # Per gli export delle transazioni in cache finisce il rollup mensile; le righe vanno nelle partizioni.
+        elif tipo == 'transazioni': da_leggere.append((importa_transazioni, percorso, servizio_nome, os.path.join(cartella_cache, CARTELLA_TRANSAZIONI) if cartella_cache else None))
+        else: da_leggere.append((leggi_report, percorso, servizio_nome))
+    # Solo i report nuovi o modificati vengono letti, in parallelo su più processi.
+    with fase("parsing Excel/CSV"):
+        letti = leggi_report_in_parallelo(da_leggere, max_workers)
+    for percorso, risultato in letti.items():
+        if isinstance(risultato, Exception):
+            errori[os.path.basename(percorso)] = f"Impossibile leggere il file '{os.path.basename(percorso)}': {risultato}"
+            continue
+        if cartella_cache:
+            with fase("scrittura cache Parquet"):
+                scrivi_in_cache(percorso, risultato, cartella_cache, indice)
+        frame_per_report[os.path.basename(percorso)] = risultato
+    if not cartella_cache: return frame_per_report, errori
+    try:
+        pulisci_cache(data_folder, cartella_cache, indice)
+        salva_indice_cache(cartella_cache, indice)
+    except OSError as e:
+        errori['cache'] = f"Impossibile aggiornare la cache dei report: {e}"
+    return frame_per_report, errori
+
+
+def sincronizza(stato, data_folder, max_workers=None):
+    """Allinea il cubo `stato` ai report della cartella: rilegge solo i file nuovi o modificati e ricalcola
+    solo le celle che toccano. A report invariati costa un `os.stat` per file.
+
+    Gli errori di lettura (report o rettifiche) finiscono in `stato.avvisi`.
+    """
+    with stato.lock:
+        with fase("firma dei report"):
+            modificati, rimossi = stato.report_da_aggiornare(firma_report(data_folder))
+        if modificati or rimossi:
+            frame, errori = leggi_report_cartella(data_folder, modificati, max_workers)
+            with fase("aggiornamento del cubo"):
+                stato.aggiorna_report(modificati, frame, rimossi)
+            for nome in [*modificati, *rimossi, 'cache']: stato.avvisi.pop(nome, None)
+            stato.avvisi.update(errori)
+        firma_regole = firma_rettifiche(data_folder)
+        if firma_regole != stato.firma_regole:
+            try:
+                regole = carica_regole(data_folder)
+                stato.avvisi.pop(FILE_RETTIFICHE, None)
+            except ValueError as e:
+                stato.avvisi[FILE_RETTIFICHE] = f"Rettifiche non applicate: {e}"
+                regole = []
+            stato.imposta_regole(firma_regole, regole)
+    return stato
+
+
+def carica_cartella(data_folder, max_workers=None):
+    """Nuovo cubo con i report della cartella (usa la cache Parquet della cartella, se presente)."""
+    if not os.path.isdir(data_folder):
+        raise FileNotFoundError(f"Cartella dei dati non trovata: '{data_folder}'.")
+    return sincronizza(CuboIncrementale(), data_folder, max_workers)
+
+
+# --- TABELLE ---
+def tabelle_confronto(aggregati, anni, attive=()):
+    """Tutte le tabelle di confronto tra `anni`, come {titolo: (tabella, formati delle colonne)}."""
+    anni = tuple(anni)
+    calcola = lambda funzione, *args: aggregati.calcola(funzione, *args, anni=anni, attive=attive)
+    tabelle = {
+        'Incassi': (calcola(tabella_confronto_servizi, 'Importo Totale', anni), formati_confronto(anni, 'valuta')),
+        'Numero Titoli': (calcola(tabella_confronto_servizi, 'Numero Titoli', anni), formati_confronto(anni, 'numero')),
+        'Redditività Media (€ per titolo)': (calcola(tabella_redditivita, anni), formati_confronto(anni, 'valuta')),
+    }
+    for metrica, (misura, tipo) in METRICHE.items():
+        for vista in VISTE:
+            tabelle[f"Mensile {metrica} - {vista}"] = (calcola(tabella_mensile, misura, vista, anni), formati_confronto(anni, tipo))
+    return tabelle
+
+
+def tabelle_anno(aggregati, anno):
+    """Tabelle del dettaglio annuale, come {titolo: (tabella, formati delle colonne)}."""
+    dettaglio = aggregati.calcola(dettaglio_anno, anno, anni=(anno,)).set_index('Servizio')
+    _, andamento = aggregati.calcola(riepilogo_anno, anno, anni=(anno,))
+    andamento.index = andamento.index.map(NOMI_MESI)
+    andamento.columns = [str(c) for c in andamento.columns]
+    return {
+        f"Dettaglio {anno}": (dettaglio, FORMATI_DETTAGLIO_ANNO),
+        f"Andamento Mensile {anno}": (andamento, {servizio: 'valuta' for servizio in SERVIZI_ORDER}),
+    }
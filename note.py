@@ -0,0 +1,259 @@
+"""Persistenza delle note: archivio locale SQLite con scrittura differita (write-behind) sul foglio.
+
+Il salvataggio scrive subito solo le note cambiate nell'archivio locale; un thread in background
+le invia poi al foglio "notes" in un unico batch (aggiornamento delle righe esistenti + accodamento
+delle nuove), attendendo qualche secondo dopo l'ultimo salvataggio e riprovando con backoff
+esponenziale in caso di errore. Le note non ancora sincronizzate restano nel database e vengono
+inviate anche dopo un riavvio del server.
+
+Il foglio è un oggetto con due metodi, `leggi()` e `upsert(righe)`: FoglioNoteGSheets usa la
+connessione Google Sheets, FoglioNoteLocale un file CSV (per lavorare e provare offline).
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from aggregati import NOMI_MESI
+from strumentazione import fase
+
+COLONNE_NOTE = ["table_key", "row_index", "note_text"]
+# Secondi di attesa dopo l'ultimo salvataggio prima di inviare il batch, e tetto del backoff sugli errori.
+ATTESA_SINCRONIZZAZIONE = 2.0
+ATTESA_MASSIMA_ERRORE = 300.0
+# Intervallo minimo tra due letture del foglio (equivalente al vecchio ttl="10m" di conn.read).
+INTERVALLO_LETTURA_FOGLIO = 600.0
+
+
+def note_da_frame(df):
+    """{table_key: {row_index: note_text}} da un frame con le colonne del foglio, senza iterare sulle righe."""
+    df = df.reindex(columns=COLONNE_NOTE).dropna(how="all").fillna("").astype(str)
+    return {chiave: dict(zip(gruppo["row_index"], gruppo["note_text"])) for chiave, gruppo in df.groupby("table_key", sort=False)}
+
+
+def frame_da_note(notes_dict):
+    righe = [(table_key, str(row_index), text) for table_key, notes in notes_dict.items() for row_index, text in notes.items()]
+    return pd.DataFrame(righe, columns=COLONNE_NOTE)
+
+
+# Le tabelle mensili erano indicizzate con i nomi dei mesi del locale del server (in inglese).
+_MESI_INGLESI = dict(zip(['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+                          'September', 'October', 'November', 'December'], NOMI_MESI.values()))
+
+
+def migra_nomi_mesi(notes_dict):
+    """Copia le note delle tabelle mensili salvate con i mesi in inglese sulle righe con i mesi in italiano.
+
+    Le righe già presenti in italiano non vengono toccate; restituisce un nuovo dizionario.
+    """
+    migrate = {}
+    for table_key, notes in notes_dict.items():
+        notes = dict(notes)
+        if table_key.startswith("notes_mensile_"):
+            for inglese, italiano in _MESI_INGLESI.items():
+                if notes.get(inglese) and not notes.get(italiano): notes[italiano] = notes[inglese]
+        migrate[table_key] = notes
+    return migrate
+
+
+# --- FOGLI ---
+# Metodi interni del client di st-gsheets-connection usati per scrivere: la versione è fissata in requirements.txt.
+METODI_CLIENT_GSHEETS = ("_select_worksheet", "_open_spreadsheet")
+
+
+def foglio_gspread(conn, worksheet):
+    """Foglio gspread di `worksheet` dalla connessione Google Sheets, creato (con l'intestazione) se manca.
+
+    È l'unico punto che usa l'API interna del client (`_select_worksheet`, `_open_spreadsheet`):
+    la connessione non espone i fogli gspread, necessari per aggiornare singole celle.
+    """
+    from gspread.exceptions import WorksheetNotFound
+    client = conn.client
+    mancanti = [m for m in METODI_CLIENT_GSHEETS if not hasattr(client, m)]
+    if mancanti:
+        raise RuntimeError(f"la connessione Google Sheets non permette la scrittura (mancano {', '.join(mancanti)}): "
+                           "serve un service account e la versione di st-gsheets-connection indicata in requirements.txt")
+    try:
+        return client._select_worksheet(worksheet=worksheet)
+    except WorksheetNotFound:
+        foglio = client._open_spreadsheet().add_worksheet(title=worksheet, rows=1000, cols=len(COLONNE_NOTE))
+        foglio.append_row(COLONNE_NOTE)
+        return foglio
+
+
+class FoglioNoteGSheets:
+    """Foglio "notes" su Google Sheets (richiede una connessione con service account per scrivere)."""
+
+    def __init__(self, conn, worksheet="notes"):
+        self.conn, self.worksheet = conn, worksheet
+
+    def leggi(self):
+        # ttl=0: la frequenza delle letture è già limitata dall'archivio.
+        with fase("Google Sheets: lettura note"):
+            return self.conn.read(worksheet=self.worksheet, usecols=[0, 1, 2], ttl=0)
+
+    def upsert(self, righe):
+        """Aggiorna le note già presenti e accoda le nuove: al massimo tre chiamate API per batch."""
+        foglio = foglio_gspread(self.conn, self.worksheet)
+        valori = foglio.get_values()
+        if not valori:
+            foglio.append_row(COLONNE_NOTE)
+        posizioni = {(r[0], r[1]): i + 1 for i, r in enumerate(valori) if len(r) >= 2}
+        aggiornamenti, nuove = [], []
+        for table_key, row_index, text in righe[COLONNE_NOTE].itertuples(index=False):
+            if (table_key, row_index) in posizioni:
+                aggiornamenti.append({"range": f"C{posizioni[(table_key, row_index)]}", "values": [[text]]})
+            else:
+                nuove.append([table_key, row_index, text])
+        if aggiornamenti: foglio.batch_update(aggiornamenti, value_input_option="RAW")
+        if nuove: foglio.append_rows(nuove, value_input_option="RAW")
+
+
+class FoglioNoteLocale:
+    """Sostituto locale del foglio, su file CSV: stesso comportamento di FoglioNoteGSheets, senza rete."""
+
+    def __init__(self, percorso):
+        self.percorso = percorso
+
+    def leggi(self):
+        if not os.path.exists(self.percorso): return pd.DataFrame(columns=COLONNE_NOTE)
+        return pd.read_csv(self.percorso, dtype=str, keep_default_na=False)
+
+    def upsert(self, righe):
+        chiavi = ["table_key", "row_index"]
+        attuali = self.leggi().set_index(chiavi)
+        nuove = righe[COLONNE_NOTE].astype(str).set_index(chiavi)
+        unite = pd.concat([attuali[~attuali.index.isin(nuove.index)], nuove]).reset_index()
+        unite.to_csv(self.percorso + ".tmp", index=False)
+        os.replace(self.percorso + ".tmp", self.percorso)
+
+
+# --- ARCHIVIO LOCALE ---
+class ArchivioNote:
+    """Archivio SQLite delle note con sincronizzazione differita verso un foglio.
+
+    Ogni nota ha una `versione` locale e la `versione_sincronizzata` inviata al foglio: le note con
+    versione maggiore sono in attesa di invio. Le righe lette dal foglio sovrascrivono solo le note
+    locali senza modifiche in attesa.
+    """
+
+    def __init__(self, percorso_db, foglio, attesa=ATTESA_SINCRONIZZAZIONE, intervallo_lettura=INTERVALLO_LETTURA_FOGLIO):
+        self.percorso_db, self.foglio = percorso_db, foglio
+        self.attesa, self.intervallo_lettura = attesa, intervallo_lettura
+        self.ultimo_errore = None
+        # Durata (s) e numero di note dell'ultimo invio riuscito al foglio, per il pannello di diagnostica.
+        self.ultimo_invio = None
+        self._ultima_lettura = None
+        self._lock, self._lock_invio = threading.Lock(), threading.Lock()
+        self._evento, self._ultima_richiesta = threading.Event(), 0.0
+        self._thread, self._fermo = None, threading.Event()
+        with self._connessione() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS note (
+                table_key TEXT NOT NULL, row_index TEXT NOT NULL, note_text TEXT NOT NULL DEFAULT '',
+                versione INTEGER NOT NULL DEFAULT 0, versione_sincronizzata INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (table_key, row_index))""")
+
+    @contextmanager
+    def _connessione(self):
+        """Connessione dedicata all'operazione: commit all'uscita (rollback in caso di errore) e chiusura."""
+        db = sqlite3.connect(self.percorso_db, timeout=10)
+        try:
+            with db: yield db
+        finally:
+            db.close()
+
+    def _leggi_tabella(self, where=""):
+        with self._connessione() as db:
+            return pd.read_sql_query(f"SELECT * FROM note {where}", db)
+
+    def carica(self):
+        return note_da_frame(self._leggi_tabella())
+
+    def in_attesa(self):
+        with self._connessione() as db:
+            return db.execute("SELECT COUNT(*) FROM note WHERE versione > versione_sincronizzata").fetchone()[0]
+
+    def aggiorna_da_foglio(self, forza=False):
+        """Importa le note dal foglio (al massimo una volta ogni `intervallo_lettura` secondi)."""
+        if not forza and self._ultima_lettura is not None and time.monotonic() - self._ultima_lettura < self.intervallo_lettura:
+            return
+        remote = self.foglio.leggi().reindex(columns=COLONNE_NOTE).dropna(how="all").fillna("").astype(str)
+        with self._lock, self._connessione() as db:
+            db.executemany("""INSERT INTO note (table_key, row_index, note_text) VALUES (?, ?, ?)
+                ON CONFLICT (table_key, row_index) DO UPDATE SET note_text = excluded.note_text
+                WHERE note.versione = note.versione_sincronizzata""", remote[COLONNE_NOTE].itertuples(index=False))
+        self._ultima_lettura = time.monotonic()
+
+    def salva(self, notes_dict, riferimento=None):
+        """Registra le note cambiate e pianifica l'invio. Restituisce quante sono cambiate.
+
+        Con `riferimento` (le note come erano al caricamento) si considerano solo le note modificate
+        rispetto a esso: così una sessione non sovrascrive le modifiche arrivate nel frattempo da altri.
+        """
+        nuove = frame_da_note(notes_dict)
+        if riferimento is not None:
+            base = frame_da_note(riferimento).rename(columns={"note_text": "note_text_base"})
+            nuove = nuove.merge(base, on=["table_key", "row_index"], how="left")
+            nuove = nuove.loc[nuove["note_text"] != nuove["note_text_base"].fillna(""), COLONNE_NOTE]
+        with self._lock, self._connessione() as db:
+            attuali = pd.read_sql_query("SELECT table_key, row_index, note_text FROM note", db)
+            confronto = nuove.merge(attuali, on=["table_key", "row_index"], how="left", suffixes=("", "_attuale"))
+            # Una nota assente nell'archivio equivale a una nota vuota.
+            cambiate = confronto[confronto["note_text"] != confronto["note_text_attuale"].fillna("")]
+            db.executemany("""INSERT INTO note (table_key, row_index, note_text, versione) VALUES (?, ?, ?, 1)
+                ON CONFLICT (table_key, row_index) DO UPDATE SET note_text = excluded.note_text, versione = note.versione + 1""",
+                cambiate[COLONNE_NOTE].itertuples(index=False))
+        if len(cambiate): self.richiedi_sincronizzazione()
+        return len(cambiate)
+
+    def sincronizza(self):
+        """Invia al foglio, in un unico batch, tutte le note in attesa. Restituisce quante ne ha inviate."""
+        with self._lock_invio:
+            pendenti = self._leggi_tabella("WHERE versione > versione_sincronizzata")
+            if pendenti.empty: return 0
+            inizio = time.perf_counter()
+            self.foglio.upsert(pendenti)
+            self.ultimo_invio = {'durata_s': time.perf_counter() - inizio, 'note': len(pendenti)}
+            # Si segna come inviata la versione spedita: una modifica arrivata nel frattempo resta in attesa.
+            with self._lock, self._connessione() as db:
+                db.executemany("UPDATE note SET versione_sincronizzata = ? WHERE table_key = ? AND row_index = ?",
+                               pendenti[["versione", "table_key", "row_index"]].itertuples(index=False))
+            return len(pendenti)
+
+    # --- SINCRONIZZAZIONE IN BACKGROUND ---
+    def richiedi_sincronizzazione(self):
+        self._ultima_richiesta = time.monotonic()
+        self._evento.set()
+
+    def avvia(self):
+        """Avvia il thread di sincronizzazione (una sola volta); invia subito le note rimaste in attesa."""
+        if self._thread is not None: return
+        self._thread = threading.Thread(target=self._ciclo, name="sincronizzazione-note", daemon=True)
+        self._thread.start()
+        if self.in_attesa(): self.richiedi_sincronizzazione()
+
+    def ferma(self):
+        self._fermo.set()
+        self._evento.set()
+        if self._thread is not None: self._thread.join()
+
+    def _ciclo(self):
+        attesa_errore = self.attesa
+        while not self._fermo.is_set():
+            self._evento.wait()
+            self._evento.clear()
+            # Debounce: più salvataggi ravvicinati finiscono nello stesso batch.
+            while (resto := self._ultima_richiesta + self.attesa - time.monotonic()) > 0:
+                if self._fermo.wait(resto): return
+            if self._fermo.is_set(): return
+            try:
+                self.sincronizza()
+                self.ultimo_errore, attesa_errore = None, self.attesa
+            except Exception as e:
+                self.ultimo_errore = str(e)
+                if self._fermo.wait(attesa_errore): return
+                attesa_errore = min(attesa_errore * 2, ATTESA_MASSIMA_ERRORE)
+                self._evento.set()
@@ -0,0 +1,106 @@
+"""Rettifiche dichiarative sugli aggregati.
+
+Le rettifiche sono descritte in un file JSON (`rettifiche.json` nella cartella dei report) e
+vengono trasformate in delta additivi sul cubo Anno × Mese × Servizio. Formato di una regola:
+
+    {"id": "leap", "etichetta": "rettifica anno bisestile", "tipo": "proporzionale",
+     "anno": 2024, "mesi": [2], "importo": -1350.84, "opzionale": true}
+
+- tipo "assoluta": aggiunge `importo` e `titoli` (intero, default 0) a `servizio` per ogni mese indicato.
+- tipo "proporzionale": ripartisce `importo` (per mese) tra i `servizi` (default tutti) in
+  proporzione agli incassi del mese; i titoli non cambiano.
+- "opzionale": false (default) la applica sempre; true la rende attivabile da una checkbox.
+
+Le regole proporzionali sono calcolate sul cubo che include già le rettifiche sempre attive.
+"""
+import json
+import os
+
+import pandas as pd
+
+from aggregati import costruisci_cubo, somma_cubi
+from ingestione import SERVIZI_ORDER
+
+FILE_RETTIFICHE = "rettifiche.json"
+TIPI_RETTIFICA = ("assoluta", "proporzionale")
+
+
+# --- LETTURA E VALIDAZIONE DELLE REGOLE ---
+def firma_rettifiche(data_folder):
+    """(mtime, dimensione) del file delle regole, da aggiungere alla chiave di st.cache_data."""
+    percorso = os.path.join(data_folder, FILE_RETTIFICHE)
+    if not os.path.exists(percorso): return None
+    stat = os.stat(percorso)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def carica_regole(data_folder):
+    """Legge e valida le regole; un file assente equivale a nessuna rettifica.
+
+    Solleva ValueError con un messaggio leggibile se il file non è valido.
+    """
+    percorso = os.path.join(data_folder, FILE_RETTIFICHE)
+    if not os.path.exists(percorso): return []
+    try:
+        with open(percorso, encoding='utf-8') as f:
+            regole = json.load(f).get('rettifiche', [])
+    except (OSError, ValueError, AttributeError) as e:
+        raise ValueError(f"file '{FILE_RETTIFICHE}' illeggibile: {e}") from e
+    if not isinstance(regole, list):
+        raise ValueError(f"file '{FILE_RETTIFICHE}': 'rettifiche' deve essere una lista di regole")
+    visti = set()
+    for i, regola in enumerate(regole):
+        if not isinstance(regola, dict):
+            raise ValueError(f"rettifica #{i + 1}: deve essere un oggetto con 'id', 'tipo', 'anno', 'mesi' e 'importo'")
+        nome = regola.get('id', f"#{i + 1}")
+        if not isinstance(regola.get('id'), str) or not regola['id'] or regola['id'] in visti:
+            raise ValueError(f"rettifica {nome}: 'id' mancante o duplicato")
+        visti.add(regola['id'])
+        if regola.get('tipo') not in TIPI_RETTIFICA:
+            raise ValueError(f"rettifica {nome}: 'tipo' deve essere uno tra {', '.join(TIPI_RETTIFICA)}")
+        if not isinstance(regola.get('anno'), int) or not isinstance(regola.get('mesi'), list) or not regola['mesi'] or not all(isinstance(m, int) and 1 <= m <= 12 for m in regola['mesi']):
+            raise ValueError(f"rettifica {nome}: 'anno' e 'mesi' (1-12) sono obbligatori")
+        if not isinstance(regola.get('importo'), (int, float)):
+            raise ValueError(f"rettifica {nome}: 'importo' deve essere un numero")
+        if not isinstance(regola.get('titoli', 0), int) or isinstance(regola.get('titoli'), bool):
+            raise ValueError(f"rettifica {nome}: 'titoli' deve essere un numero intero")
+        servizi = [regola.get('servizio')] if regola['tipo'] == 'assoluta' else regola.get('servizi', SERVIZI_ORDER)
+        if not isinstance(servizi, list) or not servizi or any(s not in SERVIZI_ORDER for s in servizi):
+            raise ValueError(f"rettifica {nome}: servizio non valido (ammessi: {', '.join(SERVIZI_ORDER)})")
+        regola.setdefault('etichetta', regola['id'])
+        regola.setdefault('opzionale', False)
+    return regole
+
+
+# --- DELTA SUL CUBO ---
+def delta_regola(cubo, regola):
+    """Delta additivo (stesso formato del cubo) prodotto da una regola."""
+    righe = []
+    for mese in regola['mesi']:
+        if regola['tipo'] == 'assoluta':
+            righe.append({'Anno': regola['anno'], 'Mese': mese, 'Servizio': regola['servizio'], 'Importo Totale': float(regola['importo']), 'Numero Titoli': regola.get('titoli', 0)})
+            continue
+        servizi = regola.get('servizi', SERVIZI_ORDER)
+        incassi = cubo[(cubo['Anno'] == regola['anno']) & (cubo['Mese'] == mese)].groupby('Servizio', observed=False)['Importo Totale'].sum().reindex(servizi, fill_value=0)
+        if incassi.sum() <= 0: continue
+        righe += [{'Anno': regola['anno'], 'Mese': mese, 'Servizio': s, 'Importo Totale': regola['importo'] * p, 'Numero Titoli': 0} for s, p in (incassi / incassi.sum()).items()]
+    if not righe:
+        return cubo.iloc[0:0]
+    delta = pd.DataFrame(righe).astype({'Anno': 'int32', 'Mese': 'int32'})
+    return costruisci_cubo(delta)[cubo.columns]
+
+
+def prepara_rettifiche(cubo_dati, regole):
+    """Applica le regole sempre attive e precalcola i delta di quelle opzionali.
+
+    Restituisce (cubo base, {id regola opzionale: delta}).
+    """
+    permanenti = [delta_regola(cubo_dati, r) for r in regole if not r['opzionale']]
+    cubo_base = somma_cubi(cubo_dati, *permanenti) if permanenti else cubo_dati
+    return cubo_base, {r['id']: delta_regola(cubo_base, r) for r in regole if r['opzionale']}
+
+
+def applica_rettifiche(cubo_base, delta, attive):
+    """Cubo con le rettifiche opzionali `attive` sommate."""
+    if not attive: return cubo_base
+    return somma_cubi(cubo_base, *(delta[i] for i in attive))
@@ -0,0 +1,119 @@
+"""Misura di tempo e memoria per fase della pipeline (lettura report, cubo, tabelle, grafici, note).
+
+Il codice della pipeline apre una fase con `with fase("nome"):`; le misure finiscono nel
+Misuratore attivo nel contesto corrente (uno per rerun di Streamlit o per prova del benchmark).
+Senza un misuratore attivo `fase` non fa nulla. La memoria (picco allocato durante la fase,
+con tracemalloc) si misura solo su richiesta, perché rallenta sensibilmente l'esecuzione.
+
+tracemalloc vale per tutto il processo: resta attivo finché almeno un misuratore con la memoria
+è in corso, e con più sessioni che misurano insieme i picchi includono anche le loro allocazioni.
+"""
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+
+_corrente = contextvars.ContextVar("misuratore", default=None)
+_lock_memoria = threading.Lock()
+# Misuratori con la memoria attivi, e se tracemalloc è stato avviato da loro (e va quindi fermato dall'ultimo).
+_misuratori_memoria = 0
+_tracemalloc_avviato = False
+
+
+def _acquisisci_memoria():
+    global _misuratori_memoria, _tracemalloc_avviato
+    with _lock_memoria:
+        if _misuratori_memoria == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_avviato = True
+        _misuratori_memoria += 1
+
+
+def _rilascia_memoria():
+    global _misuratori_memoria, _tracemalloc_avviato
+    with _lock_memoria:
+        _misuratori_memoria -= 1
+        if _misuratori_memoria == 0 and _tracemalloc_avviato:
+            tracemalloc.stop()
+            _tracemalloc_avviato = False
+
+
+class Misuratore:
+    """Raccoglie, per nome di fase, numero di chiamate, durata totale e picco di memoria."""
+
+    def __init__(self, memoria=False):
+        self.memoria = memoria
+        self.fasi = {}
+        self.durata_totale = None
+        self._pila = []  # per ogni fase aperta: [base di memoria, picco assoluto delle fasi figlie]
+        self._token = self._inizio = self._rilascio = None
+
+    def avvia(self):
+        """Rende il misuratore attivo nel contesto corrente (equivalente a entrare nel `with`)."""
+        if self.memoria:
+            _acquisisci_memoria()
+            # Se il rerun non arriva a ferma() (es. st.stop()) il rilascio avviene quando il misuratore viene raccolto.
+            self._rilascio = weakref.finalize(self, _rilascia_memoria)
+        self._token, self._inizio = _corrente.set(self), time.perf_counter()
+        return self
+
+    def ferma(self):
+        if self._token is None: return self
+        self.durata_totale = time.perf_counter() - self._inizio
+        _corrente.reset(self._token)
+        self._token = None
+        if self._rilascio is not None: self._rilascio()
+        return self
+
+    __enter__ = avvia
+
+    def __exit__(self, *eccezione):
+        self.ferma()
+
+    @contextmanager
+    def fase(self, nome):
+        misura = self.fasi.setdefault(nome, {'chiamate': 0, 'durata_s': 0.0, 'picco_memoria_mb': 0.0})
+        if self.memoria and tracemalloc.is_tracing():
+            attuale, picco = tracemalloc.get_traced_memory()
+            # Il picco accumulato finora dalla fase che contiene questa verrebbe perso con reset_peak.
+            if self._pila: self._pila[-1][1] = max(self._pila[-1][1], picco)
+            tracemalloc.reset_peak()
+            voce = [attuale, 0]
+        else:
+            voce = None
+        self._pila.append(voce)
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            durata = time.perf_counter() - inizio
+            self._pila.pop()
+            picco = 0
+            if voce is not None and tracemalloc.is_tracing():
+                assoluto = max(tracemalloc.get_traced_memory()[1], voce[1])
+                picco = assoluto - voce[0]
+                if self._pila and self._pila[-1] is not None: self._pila[-1][1] = max(self._pila[-1][1], assoluto)
+            misura['chiamate'] += 1
+            misura['durata_s'] += durata
+            misura['picco_memoria_mb'] = max(misura['picco_memoria_mb'], picco / 2 ** 20)
+
+    def riepilogo(self):
+        """Fasi nell'ordine in cui sono state aperte la prima volta: [{'fase', 'chiamate', 'durata_s', 'picco_memoria_mb'}]."""
+        return [{'fase': nome, **misura} for nome, misura in self.fasi.items()]
+
+    def to_json(self, **extra):
+        return json.dumps({'durata_totale_s': self.durata_totale, 'memoria_misurata': self.memoria, 'fasi': self.riepilogo(), **extra}, indent=1, ensure_ascii=False)
+
+
+@contextmanager
+def fase(nome):
+    """Misura il blocco come fase `nome` del misuratore attivo (se non ce n'è uno, non fa nulla)."""
+    misuratore = _corrente.get()
+    if misuratore is None:
+        yield
+        return
+    with misuratore.fase(nome):
+        yield
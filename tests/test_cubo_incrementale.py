@@ -0,0 +1,81 @@
+import os
+
+import pandas as pd
+import pytest
+
+from aggregati import DIMENSIONI, dettaglio_anno
+from benchmark import PRIMO_ANNO, aggiungi_mese, genera_cartella
+from motore import carica_cartella, sincronizza
+
+ANNI = 3
+ULTIMO_ANNO = PRIMO_ANNO + ANNI - 1
+
+
+@pytest.fixture
+def cartella(tmp_path):
+    percorso = str(tmp_path / "dati")
+    genera_cartella(percorso, ANNI)
+    return percorso
+
+
+def cubo_ordinato(aggregati):
+    return aggregati.cubo.sort_values(DIMENSIONI).reset_index(drop=True)
+
+
+def assert_come_ricostruzione(aggregati, cartella):
+    """Il cubo aggiornato in modo incrementale coincide con quello ricaricato da zero."""
+    pd.testing.assert_frame_equal(cubo_ordinato(aggregati), cubo_ordinato(carica_cartella(cartella, 1)))
+
+
+def test_aggiunta_di_un_mese(cartella):
+    aggregati = carica_cartella(cartella, 1)
+    versioni = dict(aggregati.versioni)
+    calcoli = []
+
+    def conta_dettaglio(cubo, anno):
+        calcoli.append(anno)
+        return dettaglio_anno(cubo, anno)
+    aggregati.calcola(conta_dettaglio, PRIMO_ANNO, anni=(PRIMO_ANNO,))
+    aggiungi_mese(cartella, ANNI)
+    sincronizza(aggregati, cartella, 1)
+    assert_come_ricostruzione(aggregati, cartella)
+    assert {anno for anno in versioni if aggregati.versioni[anno] != versioni[anno]} == {ULTIMO_ANNO}
+    # Gli anni non toccati restano memoizzati.
+    aggregati.calcola(conta_dettaglio, PRIMO_ANNO, anni=(PRIMO_ANNO,))
+    assert calcoli == [PRIMO_ANNO]
+
+
+def test_rerun_senza_modifiche(cartella):
+    aggregati = carica_cartella(cartella, 1)
+    versione = aggregati.versione
+    sincronizza(aggregati, cartella, 1)
+    assert aggregati.versione == versione
+
+
+def test_report_rimosso(cartella):
+    aggregati = carica_cartella(cartella, 1)
+    versioni = dict(aggregati.versioni)
+    os.remove(os.path.join(cartella, "Riepilogo_Tap&Park_Mensile.xlsx"))
+    sincronizza(aggregati, cartella, 1)
+    assert_come_ricostruzione(aggregati, cartella)
+    assert "Tap&Park (ricariche)" not in set(aggregati.cubo['Servizio'])
+    assert all(aggregati.versioni[anno] > versioni[anno] for anno in versioni)
+
+
+def test_report_illeggibile_e_poi_corretto(cartella):
+    aggregati = carica_cartella(cartella, 1)
+    percorso = os.path.join(cartella, "Riepilogo_Parcometro_Mensile.xlsx")
+    with open(percorso, 'rb') as f:
+        originale = f.read()
+    with open(percorso, 'wb') as f:
+        f.write(b"non un file excel")
+    sincronizza(aggregati, cartella, 1)
+    assert "Riepilogo_Parcometro_Mensile.xlsx" in aggregati.avvisi
+    assert "Parcometri" not in set(aggregati.cubo['Servizio'])
+    assert_come_ricostruzione(aggregati, cartella)
+    with open(percorso, 'wb') as f:
+        f.write(originale)
+    sincronizza(aggregati, cartella, 1)
+    assert "Riepilogo_Parcometro_Mensile.xlsx" not in aggregati.avvisi
+    assert_come_ricostruzione(aggregati, cartella)
+    assert "Parcometri" in set(aggregati.cubo['Servizio'])
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from formattazione import celle_tabella, format_europeo, formatta_europeo, tabella_html
+
+
+def valori_di_prova():
+    rng = np.random.default_rng(0)
+    casuali = rng.normal(0, 1e6, 2000) * rng.choice([1, 1e-3, 1e-6], 2000)
+    speciali = [0.0, -0.0, 0.005, 0.015, 2.675, -2.675, 0.5, 1.5, -0.4, 999.995, 1234567.891, -1e9, np.nan]
+    return pd.Series(np.concatenate([casuali, speciali]))
+
+
+def test_formatta_europeo_come_format_europeo():
+    valori = valori_di_prova()
+    for tipo in ('valuta', 'numero'):
+        assert formatta_europeo(valori, tipo).tolist() == [format_europeo(v, tipo) for v in valori]
+
+
+def test_formatta_europeo_con_valori_mancanti_pandas():
+    serie = pd.Series([1234.5, pd.NA, None], dtype=object)
+    assert formatta_europeo(serie).tolist() == ["€ 1.234,50", "N/A", "N/A"]
+
+
+def test_celle_tabella():
+    df = pd.DataFrame({'2024': [1234.5, 10.0], 'Variazione Assoluta': [-1.0, 20.0], 'Variazione %': [pd.NA, 12.345], 'Quota': [50.0, 0.0]},
+                      index=['Parcometri', 'TOTALE'])
+    celle = celle_tabella(df, {'2024': 'valuta', 'Variazione Assoluta': 'variazione_numero', 'Variazione %': 'percentuale', 'Quota': 'quota'})
+    assert celle.loc['Parcometri'].tolist() == ['<td>€ 1.234,50</td>', '<td>-1</td>', '<td class="nullo">N/A</td>', '<td>50.00%</td>']
+    assert celle.loc['TOTALE'].tolist() == ['<td>€ 10,00</td>', '<td>+20</td>', '<td class="positivo">+12.35%</td>', '<td>0.00%</td>']
+    html = tabella_html(celle, ['<b>', None], css=False)
+    assert '<tr class="totale"><th>TOTALE</th><td>€ 10,00</td>' in html
+    assert '<td class="nota">&lt;b&gt;</td>' in html and '<td class="nota"></td>' in html
@@ -0,0 +1,41 @@
+import glob
+import os
+import re
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from benchmark import PRIMO_ANNO, genera_cartella
+from genera_report import main
+
+
+def test_esportazione_da_riga_di_comando(tmp_path, capsys):
+    cartella, uscita = str(tmp_path / "Comune"), str(tmp_path / "report")
+    genera_cartella(cartella, 2)
+    assert main([cartella, '--uscita', uscita, '--processi', '1', '--rettifiche', 'leap']) == 0
+    destinazione = os.path.join(uscita, "Comune")
+    assert os.path.exists(os.path.join(destinazione, "report.xlsx"))
+    with open(os.path.join(destinazione, "report.html"), encoding='utf-8') as f:
+        assert f"Confronto {PRIMO_ANNO} vs {PRIMO_ANNO + 1}" in f.read()
+    csv = glob.glob(os.path.join(destinazione, "csv", "*.csv"))
+    assert csv
+    for percorso in csv:
+        with open(percorso, encoding='utf-8-sig') as f:
+            testo = f.read()
+        # Al più due decimali per valuta e percentuali, nessuno per i conteggi.
+        assert not re.search(r'\d,\d{3}', testo), percorso
+    mensile = pd.read_csv(next(p for p in csv if 'Mensile' in os.path.basename(p)), sep=';', decimal=',', index_col=0)
+    assert mensile.index[0] == "Gennaio"
+    titoli = [c for c in mensile.columns if 'Titoli' in c]
+    assert all(pd.api.types.is_integer_dtype(mensile[c]) for c in titoli)
+    foglio = load_workbook(os.path.join(destinazione, "report.xlsx")).worksheets[0]
+    valori = [c.value for riga in foglio.iter_rows(min_row=3, min_col=2) for c in riga if isinstance(c.value, float)]
+    assert valori and all(v == round(v, 2) for v in valori)
+
+
+def test_rettifica_sconosciuta(tmp_path, capsys):
+    cartella = str(tmp_path / "Comune")
+    genera_cartella(cartella, 2)
+    assert main([cartella, '--uscita', str(tmp_path / "report"), '--processi', '1', '--rettifiche', 'inesistente']) == 1
+    errore = capsys.readouterr().err
+    assert "rettifiche sconosciute: inesistente" in errore and "leap" in errore
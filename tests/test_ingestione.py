@@ -0,0 +1,28 @@
+import os
+
+from benchmark import genera_cartella
+from ingestione import leggi_report, leggi_report_in_parallelo
+
+
+def leggi_con_pid(percorso, servizio):
+    return os.getpid(), leggi_report(percorso, servizio)
+
+
+def lavori_cartella(cartella, funzione):
+    return [(funzione, os.path.join(cartella, f"Riepilogo_{nome}_Mensile.xlsx"), servizio)
+            for nome, servizio in [("Parcometro", "Parcometri"), ("Abbonamenti", "Abbonamenti")]]
+
+
+def test_file_piccoli_letti_in_serie(tmp_path):
+    genera_cartella(str(tmp_path), 2)
+    risultati = leggi_report_in_parallelo(lavori_cartella(str(tmp_path), leggi_con_pid), max_workers=2)
+    assert {pid for pid, _ in risultati.values()} == {os.getpid()}
+
+
+def test_pool_di_processi(tmp_path):
+    genera_cartella(str(tmp_path), 2)
+    in_serie = leggi_report_in_parallelo(lavori_cartella(str(tmp_path), leggi_report), max_workers=1)
+    risultati = leggi_report_in_parallelo(lavori_cartella(str(tmp_path), leggi_con_pid), max_workers=2, soglia_byte=0)
+    assert os.getpid() not in {pid for pid, _ in risultati.values()}
+    for percorso, (_, df) in risultati.items():
+        assert df.equals(in_serie[percorso])
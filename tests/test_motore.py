@@ -0,0 +1,24 @@
+import os
+
+import motore
+from benchmark import genera_cartella
+from ingestione import CARTELLA_CACHE
+
+
+def test_cartella_dei_dati_in_sola_lettura(tmp_path, monkeypatch):
+    cartella = str(tmp_path / "dati")
+    genera_cartella(cartella, 2)
+    (tmp_path / "dati" / "Transazioni_Parcometro.csv").write_text("Data Ora,Importo\n2001-12-05 10:00:00,1.5\n", encoding='utf-8')
+    attesi = motore.carica_cartella(str(tmp_path / "dati"), 1).cubo
+
+    copia = str(tmp_path / "sola_lettura")
+    genera_cartella(copia, 2)
+    (tmp_path / "sola_lettura" / "Transazioni_Parcometro.csv").write_text("Data Ora,Importo\n2001-12-05 10:00:00,1.5\n", encoding='utf-8')
+
+    def makedirs(*args, **kwargs):
+        raise PermissionError("file system in sola lettura")
+    monkeypatch.setattr(os, "makedirs", makedirs)
+    aggregati = motore.carica_cartella(copia, 1)
+    assert aggregati.cubo.equals(attesi)
+    assert "cache" in aggregati.avvisi
+    assert not os.path.exists(os.path.join(copia, CARTELLA_CACHE))
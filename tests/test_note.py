@@ -0,0 +1,100 @@
+import inspect
+
+import pandas as pd
+import pytest
+
+from benchmark import ConnessioneGSheetsFinta
+from note import COLONNE_NOTE, METODI_CLIENT_GSHEETS, ArchivioNote, FoglioNoteGSheets, FoglioNoteLocale, foglio_gspread, migra_nomi_mesi
+
+
+def archivio_locale(tmp_path):
+    return ArchivioNote(str(tmp_path / "note.sqlite3"), FoglioNoteLocale(str(tmp_path / "foglio.csv")))
+
+
+def test_salvataggio_e_sincronizzazione(tmp_path):
+    archivio = archivio_locale(tmp_path)
+    assert archivio.salva({"notes_incassi": {"Parcometri": "a", "TOTALE": "b"}}) == 2
+    assert archivio.salva({"notes_incassi": {"Parcometri": "a"}}) == 0
+    assert archivio.in_attesa() == 2
+    assert archivio.sincronizza() == 2
+    assert archivio.in_attesa() == 0
+    assert archivio.foglio.leggi().sort_values("row_index").values.tolist() == [["notes_incassi", "Parcometri", "a"], ["notes_incassi", "TOTALE", "b"]]
+
+
+def test_modifica_durante_invio_resta_in_attesa(tmp_path):
+    archivio = archivio_locale(tmp_path)
+    archivio.salva({"t": {"r": "prima"}})
+    upsert = archivio.foglio.upsert
+
+    def upsert_con_modifica(righe):
+        upsert(righe)
+        archivio.salva({"t": {"r": "dopo"}})
+    archivio.foglio.upsert = upsert_con_modifica
+    archivio.sincronizza()
+    assert archivio.in_attesa() == 1
+    archivio.foglio.upsert = upsert
+    archivio.sincronizza()
+    assert archivio.foglio.leggi()["note_text"].tolist() == ["dopo"]
+
+
+def test_lettura_del_foglio_non_sovrascrive_le_note_in_attesa(tmp_path):
+    archivio = archivio_locale(tmp_path)
+    archivio.foglio.upsert(pd.DataFrame([["t", "r1", "remota"], ["t", "r2", "remota"]], columns=COLONNE_NOTE))
+    archivio.salva({"t": {"r1": "locale"}})
+    archivio.aggiorna_da_foglio(forza=True)
+    assert archivio.carica() == {"t": {"r1": "locale", "r2": "remota"}}
+
+
+def test_salvataggio_con_riferimento_conserva_le_modifiche_altrui(tmp_path):
+    archivio = archivio_locale(tmp_path)
+    archivio.salva({"t": {"r1": "x", "r2": "x"}})
+    riferimento = archivio.carica()
+    archivio.salva({"t": {"r2": "altra sessione"}})
+    archivio.salva({"t": {"r1": "questa sessione", "r2": "x"}}, riferimento)
+    assert archivio.carica() == {"t": {"r1": "questa sessione", "r2": "altra sessione"}}
+
+
+def test_upsert_google_sheets(tmp_path):
+    connessione = ConnessioneGSheetsFinta([["t", "r1", "vecchia"], ["u", "r1", "altra tabella"]])
+    archivio = ArchivioNote(str(tmp_path / "note.sqlite3"), FoglioNoteGSheets(connessione))
+    archivio.aggiorna_da_foglio(forza=True)
+    archivio.salva({"t": {"r1": "nuova", "r2": "aggiunta"}}, archivio.carica())
+    connessione.chiamate.clear()
+    assert archivio.sincronizza() == 2
+    assert connessione.fogli["notes"].righe == [COLONNE_NOTE, ["t", "r1", "nuova"], ["u", "r1", "altra tabella"], ["t", "r2", "aggiunta"]]
+    assert sorted(connessione.chiamate) == ["append_rows", "batch_update", "get_values", "select_worksheet"]
+
+
+def test_upsert_google_sheets_foglio_mancante(tmp_path):
+    connessione = ConnessioneGSheetsFinta()
+    del connessione.fogli["notes"]
+    FoglioNoteGSheets(connessione).upsert(pd.DataFrame([["t", "r", "nota"]], columns=COLONNE_NOTE))
+    assert connessione.fogli["notes"].righe == [COLONNE_NOTE, ["t", "r", "nota"]]
+
+
+def test_migrazione_note_mensili_in_italiano():
+    note = {"notes_mensile_Tutti_i_Servizi_Importo_Totale_2024_2025": {"January": "a", "February": "b", "Febbraio": "c", "March": ""},
+            "notes_incassi": {"January": "x"}}
+    migrate = migra_nomi_mesi(note)
+    assert migrate["notes_mensile_Tutti_i_Servizi_Importo_Totale_2024_2025"] == {"January": "a", "February": "b", "Febbraio": "c", "March": "", "Gennaio": "a"}
+    assert migrate["notes_incassi"] == {"January": "x"}
+    assert "Gennaio" not in note["notes_mensile_Tutti_i_Servizi_Importo_Totale_2024_2025"]
+
+
+def test_client_gsheets_espone_i_metodi_usati():
+    # Se un aggiornamento di st-gsheets-connection rimuove o cambia questi metodi interni, il salvataggio delle note si rompe.
+    modulo = pytest.importorskip("streamlit_gsheets.gsheets_connection")
+    for metodo in METODI_CLIENT_GSHEETS:
+        assert hasattr(modulo.GSheetsServiceAccountClient, metodo), metodo
+    assert "worksheet" in inspect.signature(modulo.GSheetsServiceAccountClient._select_worksheet).parameters
+
+
+def test_connessione_senza_scrittura():
+    class ClientSolaLettura:
+        pass
+
+    class Connessione:
+        client = ClientSolaLettura()
+
+    with pytest.raises(RuntimeError, match="_select_worksheet, _open_spreadsheet"):
+        foglio_gspread(Connessione(), "notes")
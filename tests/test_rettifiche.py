@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from rettifiche import FILE_RETTIFICHE, carica_regole
+
+
+def scrivi_regole(cartella, contenuto):
+    (cartella / FILE_RETTIFICHE).write_text(json.dumps(contenuto), encoding='utf-8')
+    return str(cartella)
+
+
+def test_regole_valide(tmp_path):
+    regola = {"id": "hub", "tipo": "assoluta", "anno": 2024, "mesi": [1, 2], "servizio": "Hub Sosta (App)", "importo": 10.5, "titoli": 1}
+    assert carica_regole(scrivi_regole(tmp_path, {"rettifiche": [regola]}))[0]['opzionale'] is False
+
+
+@pytest.mark.parametrize("contenuto", [
+    ["oops"],
+    {"rettifiche": ["oops"]},
+    {"rettifiche": {"id": "hub"}},
+    {"rettifiche": [{"id": "hub", "tipo": "assoluta", "anno": 2024, "mesi": 1, "servizio": "Parcometri", "importo": 1}]},
+    {"rettifiche": [{"id": "hub", "tipo": "assoluta", "anno": 2024, "mesi": [1], "servizio": "Parcometri", "importo": 1, "titoli": 1.5}]},
+    {"rettifiche": [{"id": "hub", "tipo": "assoluta", "anno": 2024, "mesi": [1], "servizio": "Parcometri", "importo": 1, "titoli": "1"}]},
+    {"rettifiche": [{"id": ["hub"], "tipo": "assoluta", "anno": 2024, "mesi": [1], "servizio": "Parcometri", "importo": 1}]},
+    {"rettifiche": [{"id": "leap", "tipo": "proporzionale", "anno": 2024, "mesi": [2], "importo": 1, "servizi": 3}]},
+])
+def test_regole_non_valide(tmp_path, contenuto):
+    with pytest.raises(ValueError):
+        carica_regole(scrivi_regole(tmp_path, contenuto))
@@ -0,0 +1,53 @@
+import contextvars
+import gc
+import threading
+import tracemalloc
+
+from strumentazione import Misuratore, fase
+
+
+def test_fasi_annidate_in_ordine_di_apertura():
+    with Misuratore() as misuratore:
+        with fase("esterna"):
+            with fase("interna"): pass
+            with fase("interna"): pass
+    assert [(f['fase'], f['chiamate']) for f in misuratore.riepilogo()] == [("esterna", 1), ("interna", 2)]
+    assert misuratore.fasi["esterna"]['durata_s'] >= misuratore.fasi["interna"]['durata_s']
+
+
+def test_fase_senza_misuratore():
+    with fase("ignorata"): pass
+
+
+def test_memoria_con_sessioni_concorrenti():
+    """Un rerun senza memoria, o con la memoria che finisce prima, non ferma tracemalloc per gli altri."""
+    in_corso, altri_finiti = threading.Event(), threading.Event()
+    risultati = {}
+
+    def con_memoria():
+        with Misuratore(memoria=True) as misuratore:
+            in_corso.set()
+            altri_finiti.wait(10)
+            with fase("allocazione"):
+                blocco = bytearray(20 * 2 ** 20)
+            del blocco
+        risultati['picco'] = misuratore.fasi["allocazione"]['picco_memoria_mb']
+
+    def altri():
+        in_corso.wait(10)
+        with Misuratore(): pass
+        with Misuratore(memoria=True): pass
+        altri_finiti.set()
+
+    thread = [threading.Thread(target=con_memoria), threading.Thread(target=altri)]
+    for t in thread: t.start()
+    for t in thread: t.join()
+    assert risultati['picco'] >= 19
+    assert not tracemalloc.is_tracing()
+
+
+def test_memoria_rilasciata_senza_ferma():
+    # Come un rerun interrotto da st.stop(): ferma() non viene chiamato e il contesto viene scartato.
+    contextvars.Context().run(lambda: Misuratore(memoria=True).avvia())
+    gc.collect()
+    assert not tracemalloc.is_tracing()
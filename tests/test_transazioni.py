@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from grafici import figure_transazioni
+from transazioni import ArchivioTransazioni, importa_transazioni, leggi_transazioni
+
+
+def scrivi(percorso, testo):
+    percorso.write_text(testo, encoding='utf-8')
+    return str(percorso)
+
+
+def test_date_iso(tmp_path):
+    csv = scrivi(tmp_path / "Transazioni_Parcometro.csv", "Data Ora,Importo\n2024-01-05 10:00:00,1.5\n2024-01-20 11:30:00,2\n2024-02-13 08:00:00,3\n")
+    df = leggi_transazioni(csv, "Parcometri")
+    assert df['DATA_ORA'].tolist() == [pd.Timestamp("2024-01-05 10:00"), pd.Timestamp("2024-01-20 11:30"), pd.Timestamp("2024-02-13 08:00")]
+
+
+def test_date_giorno_prima_con_punto_e_virgola(tmp_path):
+    csv = scrivi(tmp_path / "Transazioni_Parcometro.csv", "Data Ora;Importo;Numero Titoli\n05/01/2024 10:00;1,50;1\n20/01/2024 11:30;2,00;2\n13/02/2024 08:00;3,25;1\n")
+    mensile = importa_transazioni(csv, "Parcometri", str(tmp_path / "partizioni"))
+    assert mensile[['Anno', 'Mese', 'Importo Totale', 'Numero Titoli']].values.tolist() == [[2024, 1, 3.5, 3], [2024, 2, 3.25, 1]]
+    assert sorted(p.name for p in (tmp_path / "partizioni").iterdir()) == ["2024-01", "2024-02"]
+
+
+def test_date_non_valide(tmp_path):
+    csv = scrivi(tmp_path / "Transazioni_Parcometro.csv", "Data Ora,Importo\n2024-01-05 10:00:00,1.5\nTotale,1.5\n")
+    with pytest.raises(ValueError, match="riga 3"):
+        leggi_transazioni(csv, "Parcometri")
+
+
+def test_figure_memoizzate_per_firma_delle_partizioni(tmp_path):
+    partizioni = str(tmp_path / "partizioni")
+    csv = scrivi(tmp_path / "Transazioni_Parcometro.csv", "Data Ora,Importo\n2024-01-05 10:00:00,1.5\n2024-01-06 11:00:00,2\n")
+    importa_transazioni(csv, "Parcometri", partizioni)
+    archivio = ArchivioTransazioni(partizioni)
+    figure = archivio.calcola(figure_transazioni, 2024)
+    assert archivio.calcola(figure_transazioni, 2024) is figure
+    assert archivio.calcola(figure_transazioni, 2023) is None
+    scrivi(tmp_path / "Transazioni_Parcometro.csv", "Data Ora,Importo\n2024-01-05 10:00:00,1.5\n2024-02-06 11:00:00,2\n")
+    importa_transazioni(csv, "Parcometri", partizioni)
+    aggiornate = archivio.calcola(figure_transazioni, 2024)
+    assert aggiornate is not figure and len(aggiornate[0].data[0].x) == 2
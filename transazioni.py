@@ -0,0 +1,180 @@
+"""Transazioni: export dei singoli titoli (parcometri, app, ...) in un archivio colonnare per mese.
+
+Un file `Transazioni_<Servizio>[_<qualsiasi>].xlsx|csv` viene letto una sola volta: le righe
+sono scritte in Parquet, una partizione per mese (`.cache_report/transazioni/AAAA-MM/`), e al
+cubo arriva solo il rollup mensile, nello stesso formato dei report di riepilogo. I rollup
+giornalieri e orari vengono calcolati solo quando servono, un mese alla volta, e memoizzati
+finché la partizione non cambia: le interrogazioni non scorrono mai le transazioni grezze.
+
+Per uno stesso servizio e mese vanno forniti il riepilogo oppure le transazioni, non entrambi:
+i contributi al cubo si sommano.
+"""
+import glob
+import os
+import re
+import threading
+
+import pandas as pd
+
+from aggregati import MISURE, filtra_servizi
+from ingestione import SERVIZI_ORDER, leggi_colonne, nome_parquet
+
+# Colonne dell'export -> colonne dell'archivio. Solo data/ora e importo sono obbligatorie:
+# senza "Numero Titoli" ogni riga vale un titolo.
+COLONNE_TRANSAZIONI = {
+    'DATA_ORA_INSERIMENTO': 'DATA_ORA', 'Data Ora': 'DATA_ORA', 'Data': 'DATA_ORA',
+    'Importo': 'Importo', 'Importo Totale': 'Importo', 'Numero Titoli': 'Titoli', 'Titoli': 'Titoli',
+    'Parcometro': 'Dispositivo', 'Dispositivo': 'Dispositivo',
+}
+OBBLIGATORIE = ['DATA_ORA', 'Importo']
+# Livello di dettaglio dei rollup -> frequenza del periodo pandas.
+FREQUENZE = {'mensile': 'M', 'giornaliero': 'D', 'orario': 'h'}
+# Date testuali con il giorno prima (GG/MM/AAAA, anche con '.' o '-'); tutte le altre sono lette come ISO.
+DATA_GIORNO_PRIMA = re.compile(r'\d{1,2}[/.-]\d{1,2}[/.-]\d{4}')
+
+
+# --- LETTURA E PARTIZIONAMENTO ---
+def _leggi_csv(percorso):
+    """Colonne utili di un export CSV; con il separatore ';' i decimali sono con la virgola."""
+    with open(percorso, encoding='utf-8-sig') as f:
+        intestazione = f.readline()
+    sep = ';' if intestazione.count(';') > intestazione.count(',') else ','
+    df = pd.read_csv(percorso, sep=sep, decimal=',' if sep == ';' else '.', encoding='utf-8-sig', usecols=lambda c: c.strip() in COLONNE_TRANSAZIONI)
+    df.columns = [COLONNE_TRANSAZIONI[c.strip()] for c in df.columns]
+    df = df.loc[:, ~df.columns.duplicated()]
+    mancanti = set(OBBLIGATORIE) - set(df.columns)
+    if mancanti:
+        raise ValueError(f"colonne mancanti: {', '.join(sorted(mancanti))}")
+    return {nome: df[nome].tolist() for nome in df.columns}
+
+
+def converti_date(valori):
+    """Date delle transazioni: celle data di Excel, testi ISO (AAAA-MM-GG [hh:mm[:ss]]) o GG/MM/AAAA [hh:mm[:ss]].
+
+    Solleva ValueError se qualche valore non è una data valida, indicando quante righe e la prima.
+    """
+    serie = pd.Series(valori, dtype=object)
+    testi = serie.map(lambda v: isinstance(v, str))
+    stringhe = serie[testi].str.strip()
+    giorno_prima = stringhe.str.fullmatch(DATA_GIORNO_PRIMA.pattern + r'(?:\s.*)?')
+    date = pd.concat([
+        pd.to_datetime(serie[~testi], errors='coerce'),
+        pd.to_datetime(stringhe[~giorno_prima], format='ISO8601', errors='coerce'),
+        pd.to_datetime(stringhe[giorno_prima], format='mixed', dayfirst=True, errors='coerce'),
+    ]).reindex(serie.index)
+    if date.isna().any():
+        errate = date.index[date.isna()]
+        # +2: riga di intestazione e numerazione da 1, come nel foglio di calcolo.
+        raise ValueError(f"{len(errate)} righe con data/ora non valida (la prima è la riga {errate[0] + 2}: {serie[errate[0]]!r})")
+    return date
+
+
+def leggi_transazioni(percorso, servizio):
+    """Frame compatto delle transazioni: DATA_ORA, Servizio e Dispositivo categorici, Importo, Titoli int32."""
+    colonne = _leggi_csv(percorso) if percorso.lower().endswith('.csv') else leggi_colonne(percorso, COLONNE_TRANSAZIONI, OBBLIGATORIE)
+    data_ora = converti_date(colonne['DATA_ORA'])
+    titoli = pd.to_numeric(pd.Series(colonne['Titoli'], dtype=object)) if 'Titoli' in colonne else pd.Series(1, index=data_ora.index)
+    df = pd.DataFrame({
+        'DATA_ORA': data_ora.astype('datetime64[s]'),
+        'Servizio': pd.Categorical([servizio] * len(data_ora), categories=SERVIZI_ORDER, ordered=True),
+        'Dispositivo': pd.Series(colonne.get('Dispositivo', [None] * len(data_ora)), dtype=object).astype('string').astype('category'),
+        'Importo': pd.to_numeric(pd.Series(colonne['Importo'], dtype=object)).astype('float64'),
+        'Titoli': titoli.fillna(1).astype('int32'),
+    })
+    return df
+
+
+def importa_transazioni(percorso, servizio, cartella_partizioni):
+    """Legge un export, ne scrive le partizioni mensili e restituisce il rollup mensile per il cubo.
+
+    Gira anche nei processi worker: al processo principale torna solo il rollup, non le righe.
+    Con `cartella_partizioni` None (cache non disponibile) restituisce solo il rollup.
+    """
+    df = leggi_transazioni(percorso, servizio)
+    if cartella_partizioni is None: return rollup_mensile(df)
+    nome = nome_parquet(percorso)
+    # Un file modificato può non coprire più gli stessi mesi: le sue vecchie partizioni vanno tolte tutte.
+    for vecchia in glob.glob(os.path.join(cartella_partizioni, '*', nome)): os.remove(vecchia)
+    for mese, righe in df.groupby(df['DATA_ORA'].dt.to_period('M'), sort=True):
+        cartella = os.path.join(cartella_partizioni, str(mese))
+        os.makedirs(cartella, exist_ok=True)
+        righe.to_parquet(os.path.join(cartella, nome + ".tmp"), index=False)
+        os.replace(os.path.join(cartella, nome + ".tmp"), os.path.join(cartella, nome))
+    return rollup_mensile(df)
+
+
+# --- ROLLUP ---
+def rollup(df, livello):
+    """Importi e titoli sommati per periodo (inizio del mese, del giorno o dell'ora) e servizio."""
+    periodo = df['DATA_ORA'].dt.to_period(FREQUENZE[livello]).dt.start_time.rename('Periodo')
+    return df.groupby([periodo, 'Servizio'], observed=True).agg(**{'Importo Totale': ('Importo', 'sum'), 'Numero Titoli': ('Titoli', 'sum')}).reset_index()
+
+
+def rollup_mensile(df):
+    """Rollup mensile nel formato di frame_tipizzato (quello dei report di riepilogo)."""
+    mensile = rollup(df, 'mensile').rename(columns={'Periodo': 'DATA_ORA_INSERIMENTO'})
+    mensile.insert(1, 'Anno', mensile['DATA_ORA_INSERIMENTO'].dt.year.astype('int32'))
+    mensile.insert(2, 'Mese', mensile['DATA_ORA_INSERIMENTO'].dt.month.astype('int32'))
+    return mensile.astype({'Numero Titoli': 'int64'})
+
+
+class ArchivioTransazioni:
+    """Rollup delle partizioni mensili, calcolati su richiesta e memoizzati per firma della partizione.
+
+    Un'istanza è condivisa tra le sessioni Streamlit (st.cache_resource).
+    """
+
+    def __init__(self, cartella_partizioni):
+        self.cartella = cartella_partizioni
+        self.lock = threading.Lock()
+        self._memo = {}  # (livello, mese) -> (firma della partizione, rollup)
+        self._memo_anno = {}  # (funzione, anno, argomenti) -> (firma delle partizioni dell'anno, risultato)
+
+    def _file(self, mese):
+        return sorted(glob.glob(os.path.join(self.cartella, mese, '*.parquet')))
+
+    def mesi(self):
+        """Mesi ('AAAA-MM') con almeno una partizione."""
+        if not os.path.isdir(self.cartella): return []
+        return sorted(m for m in os.listdir(self.cartella) if self._file(m))
+
+    def rollup_mese(self, livello, mese):
+        file = self._file(mese)
+        firma = tuple((os.path.basename(p), os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in file)
+        with self.lock:
+            voce = self._memo.get((livello, mese))
+            if voce is None or voce[0] != firma:
+                righe = pd.concat([pd.read_parquet(p, columns=['DATA_ORA', 'Servizio', 'Importo', 'Titoli']) for p in file], ignore_index=True)
+                voce = self._memo[(livello, mese)] = (firma, rollup(righe, livello))
+        return voce[1]
+
+    def firma_anno(self, anno):
+        """(mese, file, mtime, dimensione) delle partizioni dell'anno, con un solo glob; vuota se l'anno non ha transazioni."""
+        firma = []
+        for p in sorted(glob.glob(os.path.join(self.cartella, f"{anno}-*", '*.parquet'))):
+            stat = os.stat(p)
+            firma.append((os.path.basename(os.path.dirname(p)), os.path.basename(p), stat.st_mtime_ns, stat.st_size))
+        return tuple(firma)
+
+    def calcola(self, funzione, anno, *args):
+        """`funzione(serie giornaliera, serie oraria, anno, *args)` memoizzata finché le partizioni dell'anno non cambiano.
+
+        Pensata per grafici.figure_transazioni. Restituisce None se l'anno non ha transazioni.
+        """
+        firma = self.firma_anno(anno)
+        if not firma: return None
+        chiave = (funzione.__name__, anno, args)
+        with self.lock:
+            voce = self._memo_anno.get(chiave)
+        if voce is None or voce[0] != firma:
+            # Calcolo fuori dal lock: serie() lo usa a sua volta per i rollup dei mesi.
+            voce = (firma, funzione(self.serie('giornaliero', anno), self.serie('orario', anno), anno, *args))
+            with self.lock: self._memo_anno[chiave] = voce
+        return voce[1]
+
+    def serie(self, livello, anno, vista='Tutti i Servizi'):
+        """Serie dell'anno per la vista del menu servizi: una riga per periodo, colonne Importo Totale e Numero Titoli."""
+        mesi = [m for m in self.mesi() if m.startswith(f"{anno}-")]
+        if not mesi: return pd.DataFrame(columns=MISURE, index=pd.DatetimeIndex([], name='Periodo'))
+        df = pd.concat([self.rollup_mese(livello, m) for m in mesi], ignore_index=True)
+        return filtra_servizi(df, vista).groupby('Periodo')[MISURE].sum()